@@ -0,0 +1,316 @@
+"""Benchmarks for project indexing, template rendering, and repository upload and reindex paths.
+
+Synthetic projects are generated as small but valid wheels, spread across many versions, and all repository
+operations run against an in-memory stand-in for S3. For each operation and project size, the CPU time,
+wall-clock time, peak memory allocated by Python, and number of storage requests are reported.
+
+Requires Python 3 and the dependencies of stick. Run from the root of the source tree:
+
+    python benchmarks/bench.py --files 10,100,1000
+"""
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from collections import Counter, OrderedDict
+
+import click
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from stick.j2 import get_template  # noqa: E402
+from stick.project import Project  # noqa: E402
+from stick.remote import parse_metadata  # noqa: E402
+from stick.repository import Repository  # noqa: E402
+from stick.storage import MemoryStorage, Storage  # noqa: E402
+
+PROJECT_NAME = 'bench-project'
+PLATFORM_TAGS = ['py2.py3-none-any', 'cp36-cp36m-manylinux1_x86_64', 'cp37-cp37m-manylinux1_x86_64',
+                 'cp38-cp38-manylinux1_x86_64', 'cp38-cp38-win_amd64', 'cp39-cp39-macosx_10_9_x86_64']
+METADATA = """Metadata-Version: 2.1
+Name: {name}
+Version: {version}
+Summary: Synthetic project for benchmarking
+Home-page: https://example.com/{name}
+Author: Benchmark
+Author-email: benchmark@example.com
+License: Apache 2.0
+Requires-Python: >=3.6
+Requires-Dist: click
+Requires-Dist: jinja2
+Classifier: Programming Language :: Python :: 3
+
+{description}
+"""
+
+
+class SyntheticPackage(object):
+    """A wheel with the attributes of twine's PackageFile that stick uses, built without twine's parsing overhead"""
+    def __init__(self, filename, metadata, python_version):
+        with open(filename, 'rb') as data:
+            contents = data.read()
+        self.filename = filename
+        self.basefilename = os.path.basename(filename)
+        self.signed_basefilename = self.basefilename + '.asc'
+        self.safe_name = PROJECT_NAME
+        self.comment = None
+        self.filetype = 'bdist_wheel'
+        self.python_version = python_version
+        self.md5_digest = hashlib.md5(contents).hexdigest()
+        self.sha2_digest = hashlib.sha256(contents).hexdigest()
+        self.gpg_signature = None
+        self.metadata = parse_metadata(metadata.encode('utf-8'))
+
+
+class CountingStorage(Storage):
+    """In-memory storage that counts the requests made against it"""
+    def __init__(self, objects=None):
+        self.backend = MemoryStorage()
+        self.backend.objects.update(objects or {})
+        self.calls = Counter()
+
+    def head(self, key):
+        self.calls['HEAD'] += 1
+        return self.backend.head(key)
+
+    def get(self, key, if_none_match=None, byte_range=None):
+        self.calls['GET'] += 1
+        return self.backend.get(key, if_none_match, byte_range)
+
+    def put(self, key, body, content_type, content_encoding=None, cache_control=None, if_match=None, if_none_match=None):
+        self.calls['PUT'] += 1
+        return self.backend.put(key, body, content_type, content_encoding, cache_control, if_match, if_none_match)
+
+    def delete(self, key):
+        self.calls['DELETE'] += 1
+        return self.backend.delete(key)
+
+    def upload_file(self, filename, key, content_type):
+        self.calls['PUT'] += 1
+        return self.backend.upload_file(filename, key, content_type)
+
+    def download_file(self, key, filename):
+        self.calls['GET'] += 1
+        return self.backend.download_file(key, filename)
+
+    def list(self, prefix, delimiter=None):
+        for page in self.backend.list(prefix, delimiter):
+            self.calls['LIST'] += 1
+            yield page
+
+
+class Fixture(object):
+    """A synthetic project of a given size, with its wheels on disk and a bucket containing the wheels and their manifest.
+
+    The indexes are not published until a benchmark asks for them, as publishing every release takes time quadratic in the
+    number of files.
+    """
+    def __init__(self, directory, files, files_per_version):
+        self.directory = directory
+        self.packages = [self._make_package(i, files_per_version) for i in range(files + 1)]
+        # The last package is held back, to measure adding a single file to an existing project
+        self.extra_package = self.packages.pop()
+        self._published_objects = None
+
+        # Store the wheels directly and write the manifest once, rather than uploading them one at a time
+        storage = CountingStorage()
+        repository = self.make_repository(storage)
+        project = Project(PROJECT_NAME, repository)
+        package_infos = []
+        for package in self.packages:
+            key = 'simple/{0}/{1}'.format(PROJECT_NAME, package.basefilename)
+            etag = storage.upload_file(package.filename, key, 'application/octet-stream')['ETag']
+            package_infos.append(project.make_package_info(package, etag=etag))
+        project.add_package_infos(package_infos)
+        repository._put_manifest(PROJECT_NAME, project)
+        self.objects = dict(storage.backend.objects)
+
+    @property
+    def published_objects(self):
+        """The bucket with the indexes of the project and repository published as well, built on first use"""
+        if self._published_objects is None:
+            storage = CountingStorage(self.objects)
+            repository = self.make_repository(storage)
+            project = repository._get_project(PROJECT_NAME)
+            repository._publish_project(PROJECT_NAME, set(p['version'] for p in project.manifest))
+            repository.update_index()
+            self._published_objects = dict(storage.backend.objects)
+        return self._published_objects
+
+    def make_repository(self, storage):
+        return Repository('bench-bucket', None, 'simple/', None, storage=storage)
+
+    def make_project(self):
+        project = Project(PROJECT_NAME, self.make_repository(CountingStorage()))
+        for package in self.packages:
+            project.add_package(package)
+        return project
+
+    def _make_package(self, index, files_per_version):
+        number = index // files_per_version
+        version = '{0}.{1}.{2}'.format(number // 100, number // 10 % 10, number % 10)
+        tag = PLATFORM_TAGS[index % files_per_version % len(PLATFORM_TAGS)]
+        if index % files_per_version >= len(PLATFORM_TAGS):
+            version += '.post{0}'.format(index % files_per_version // len(PLATFORM_TAGS))
+        name = PROJECT_NAME.replace('-', '_')
+        filename = os.path.join(self.directory, '{0}-{1}-{2}.whl'.format(name, version, tag))
+
+        dist_info = '{0}-{1}.dist-info'.format(name, version)
+        metadata = METADATA.format(name=PROJECT_NAME, version=version, description='Lorem ipsum dolor sit amet. ' * 40)
+        with zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED) as wheel:
+            wheel.writestr('{0}/__init__.py'.format(name), '')
+            wheel.writestr('{0}/METADATA'.format(dist_info), metadata)
+            wheel.writestr('{0}/WHEEL'.format(dist_info), 'Wheel-Version: 1.0\nRoot-Is-Purelib: true\nTag: {0}\n'.format(tag))
+            wheel.writestr('{0}/RECORD'.format(dist_info), '')
+        return SyntheticPackage(filename, metadata, tag.split('-')[0])
+
+
+def bench_add_package(fixture):
+    project = Project(PROJECT_NAME, fixture.make_repository(CountingStorage()))
+
+    def run():
+        for package in fixture.packages:
+            project.add_package(package)
+    return run, CountingStorage()
+
+
+def bench_get_metadata(fixture):
+    project = fixture.make_project()
+    return project.get_metadata, CountingStorage()
+
+
+def bench_metadata_json(fixture):
+    project = fixture.make_project()
+    return lambda: sum(len(chunk) for chunk in project.iter_metadata_json()), CountingStorage()
+
+
+def bench_render_index(fixture):
+    project = fixture.make_project()
+    template = get_template('index.html.j2')
+    return lambda: sum(len(chunk) for chunk in template.generate(project=project)), CountingStorage()
+
+
+def bench_render_release(fixture):
+    project = fixture.make_project()
+    template = get_template('release.html.j2')
+    version = str(project.latest_version)
+    return lambda: sum(len(chunk) for chunk in template.generate(project=project, version=version)), CountingStorage()
+
+
+def bench_upload_all(fixture):
+    storage = CountingStorage()
+    repository = fixture.make_repository(storage)
+
+    def run():
+        repository.upload_packages(fixture.packages)
+        repository.update_index()
+    return run, storage
+
+
+def bench_upload_one(fixture):
+    storage = CountingStorage(fixture.published_objects)
+    repository = fixture.make_repository(storage)
+
+    def run():
+        repository.upload(fixture.extra_package)
+        repository.update_index()
+    return run, storage
+
+
+def bench_reindex(fixture):
+    storage = CountingStorage(fixture.published_objects)
+    repository = fixture.make_repository(storage)
+    return lambda: repository.reindex([PROJECT_NAME]), storage
+
+
+def bench_reindex_metadata_only(fixture):
+    storage = CountingStorage(fixture.published_objects)
+    repository = fixture.make_repository(storage)
+    return lambda: repository.reindex([PROJECT_NAME], metadata_only=True), storage
+
+
+BENCHMARKS = OrderedDict([
+    ('project.add_package', bench_add_package),
+    ('project.get_metadata', bench_get_metadata),
+    ('project.iter_metadata_json', bench_metadata_json),
+    ('render.index', bench_render_index),
+    ('render.release', bench_render_release),
+    ('repository.upload_all', bench_upload_all),
+    ('repository.upload_one', bench_upload_one),
+    ('repository.reindex', bench_reindex),
+    ('repository.reindex_metadata_only', bench_reindex_metadata_only),
+    ])
+# Writing the JSON metadata for every release takes time quadratic in the number of files, so these are slow for large projects
+QUADRATIC_BENCHMARKS = ['repository.upload_all', 'repository.reindex', 'repository.reindex_metadata_only']
+
+
+def measure(setup, fixture, repeat, memory):
+    """Run a benchmark, returning the best times across repeats along with its peak memory use and request counts"""
+    cpu_times = []
+    wall_times = []
+    for _ in range(repeat):
+        run, storage = setup(fixture)
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        run()
+        cpu_times.append(time.process_time() - cpu_start)
+        wall_times.append(time.perf_counter() - wall_start)
+
+    # Tracing allocations slows everything down considerably, so memory is measured in a separate run
+    peak = None
+    if memory:
+        run, _ = setup(fixture)
+        tracemalloc.start()
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return OrderedDict([
+        ('cpu_seconds', min(cpu_times)),
+        ('wall_seconds', min(wall_times)),
+        ('peak_bytes', peak),
+        ('requests', dict(storage.calls)),
+        ])
+
+
+@click.command()
+@click.option('--files', default='10,100,1000', help='Comma-separated list of project sizes, in files, to benchmark.')
+@click.option('--files-per-version', default=4, type=click.IntRange(min=1), help='Number of files in each release.')
+@click.option('--only', multiple=True, type=click.Choice(list(BENCHMARKS)), help='Run only the named benchmarks.')
+@click.option('--repeat', default=1, type=click.IntRange(min=1), help='Report the best time out of this many runs.')
+@click.option('--memory/--no-memory', default=True, help='Measure peak memory use with tracemalloc.')
+@click.option('--max-quadratic-files', default=2000, type=click.IntRange(min=0),
+              help='Skip benchmarks that publish every release for projects with more files than this.')
+@click.option('--json', 'json_output', type=click.File('w'), help='Also write the results as JSON to this file.')
+def main(files, files_per_version, only, repeat, memory, max_quadratic_files, json_output):
+    results = []
+    click.echo('{0:<36} {1:>7} {2:>9} {3:>9} {4:>10}  {5}'.format('benchmark', 'files', 'cpu (s)', 'wall (s)', 'peak (MiB)', 'requests'))
+    for size in [int(s) for s in files.split(',')]:
+        directory = tempfile.mkdtemp(prefix='stick-bench-')
+        try:
+            fixture = Fixture(directory, size, files_per_version)
+            for name, setup in BENCHMARKS.items():
+                if only and name not in only:
+                    continue
+                if name in QUADRATIC_BENCHMARKS and size > max_quadratic_files:
+                    click.echo('{0:<36} {1:>7}  skipped; see --max-quadratic-files'.format(name, size))
+                    continue
+                result = measure(setup, fixture, repeat, memory)
+                results.append(OrderedDict([('benchmark', name), ('files', size)], **result))
+                click.echo('{0:<36} {1:>7} {2:>9.3f} {3:>9.3f} {4:>10}  {5}'.format(
+                    name, size, result['cpu_seconds'], result['wall_seconds'],
+                    '-' if result['peak_bytes'] is None else '{0:.1f}'.format(result['peak_bytes'] / 1048576.0),
+                    ' '.join('{0}={1}'.format(k, v) for k, v in sorted(result['requests'].items()))))
+        finally:
+            shutil.rmtree(directory)
+
+    if json_output:
+        json.dump(results, json_output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
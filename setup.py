@@ -29,7 +29,11 @@ setup(
         'console_scripts': ['stick=stick.commands:cli']
     },
     extras_require={
+        'brotli': [
+            'brotli',
+        ],
         'dev': [
+            'pytest',
             'setuptools-version-command',
         ]
     },
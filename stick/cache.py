@@ -0,0 +1,131 @@
+import errno
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from stat import S_ISREG
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+class DiskCache(object):
+    """Size-bounded on-disk cache of S3 objects, evicting the least recently used entries first.
+
+    Each entry is stored in a single file containing a line of JSON metadata (including the object's ETag)
+    followed by the object body, so that entries can be replaced atomically by concurrent processes.
+    """
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise e
+
+    def get(self, key):
+        """Return (metadata, body) for a cached object, or (None, None) if it is not cached"""
+        metadata, data = self.open(key)
+        if data is None:
+            return None, None
+        with data:
+            return metadata, data.read()
+
+    def open(self, key):
+        """Return (metadata, file) for a cached object, with the file positioned at the start of the body, or (None, None) if it is not cached.
+
+        The file remains readable if the entry is replaced or evicted while it is open.
+        """
+        path = self._get_path(key)
+        try:
+            data = open(path, 'rb')
+        except (IOError, OSError):
+            return None, None
+
+        try:
+            metadata = json.loads(data.readline().decode('utf-8'))
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            metadata = None
+
+        if metadata is None or metadata.get('Key') != key:
+            data.close()
+            return None, None
+        return metadata, data
+
+    def put(self, key, metadata, body):
+        """Store an object body, as bytes or a file-like object, along with its metadata, then evict old entries if the cache is over size.
+
+        Returns False if the object was not stored, such as when its body is larger than the whole cache.
+        """
+        metadata = dict(metadata, Key=key)
+        path = self._get_path(key)
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as data:
+                data.write(json.dumps(metadata, sort_keys=True).encode('utf-8') + b'\n')
+                size = 0
+                chunks = [body] if isinstance(body, bytes) else iter(lambda: body.read(COPY_BUFFER_SIZE), b'')
+                for chunk in chunks:
+                    size += len(chunk)
+                    if size > self.max_size:
+                        break
+                    data.write(chunk)
+            if size > self.max_size:
+                # Evicting every other entry would still not make room for it
+                logger.debug('Not caching {0}, which is larger than the cache'.format(key))
+                os.unlink(temp_path)
+                return False
+            os.rename(temp_path, path)
+        except Exception as e:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            # Errors reading a streamed body are the caller's to handle
+            if not isinstance(e, (IOError, OSError)):
+                raise e
+            logger.warn('Failed to cache {0}'.format(key), exc_info=True)
+            return False
+
+        self._evict(os.path.basename(path))
+        return True
+
+    def delete(self, key):
+        """Remove an object from the cache, if it is cached"""
+        try:
+            os.unlink(self._get_path(key))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise e
+
+    def _get_path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+    def _evict(self, keep):
+        """Evict the least recently used entries until the cache is within its size, other than the named entry"""
+        entries = []
+        total_size = 0
+        for name in os.listdir(self.directory):
+            if name.endswith('.tmp'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            # Skip directories, such as the compiled template cache
+            if S_ISREG(stat.st_mode):
+                total_size += stat.st_size
+                if name != keep:
+                    entries.append((stat.st_mtime, stat.st_size, name))
+
+        for _, size, name in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            logger.debug('Evicting {0} from cache'.format(name))
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total_size -= size
@@ -1,12 +1,14 @@
+import json
 import logging
 import os
 import sys
 
-import boto3
 import click
-from twine.package import PackageFile
 
-from . import util
+from . import compression, util
+from .journal import Journal
+from .manifest import MANIFEST_FORMATS
+from .preprocess import find_distributions, prepare_packages, sign_packages
 from .settings import Settings
 
 try:
@@ -45,6 +47,9 @@ def _check_url(ctx, param, value):
 
 
 def _check_prefix(ctx, param, value):
+    if value is None:
+        return
+
     if not value.endswith('/'):
         value += '/'
         click.echo(message='Trailing slash missing from prefix; prefix has been set to {}'.format(value))
@@ -52,15 +57,76 @@ def _check_prefix(ctx, param, value):
     return value
 
 
+def _check_compress(ctx, param, value):
+    if value == 'br' and compression.brotli is None:
+        raise click.BadParameter('the brotli package must be installed to use brotli compression')
+
+    return value
+
+
 def _check_profile(ctx, param, value):
+    import boto3
     try:
-        boto3.Session(profile_name=value).client('sts', config=util.client_config).get_caller_identity()
+        boto3.Session(profile_name=value).client('sts', config=util.get_client_config()).get_caller_identity()
     except Exception as e:
         raise click.BadParameter('{}'.format(e), param_hint=param)
 
     return value
 
 
+def _check_simple_json_prefix(kwargs):
+    simple_json_prefix = kwargs['simple_json_prefix']
+    if simple_json_prefix and (simple_json_prefix.startswith(kwargs['prefix']) or kwargs['prefix'].startswith(simple_json_prefix)):
+        raise click.BadParameter('the JSON index must not overlap the HTML index prefix', param_hint='simple-json-prefix')
+
+
+def _add_signatures(upload_settings, packages, signatures):
+    """Attach existing signature files to packages, signing the others if signing is enabled"""
+    to_sign = []
+    for package in packages:
+        signed_name = package.signed_basefilename
+        if signed_name in signatures:
+            package.add_gpg_signature(signatures[signed_name], signed_name)
+        elif upload_settings.sign:
+            to_sign.append(package)
+
+    if to_sign:
+        sign_packages(to_sign, upload_settings.sign_with, upload_settings.identity, upload_settings.jobs)
+
+
+def _upload_packages(upload_settings, repository, packages, signatures):
+    """Sign and upload packages, then update the repository index"""
+    _add_signatures(upload_settings, packages, signatures)
+    if not packages:
+        return
+
+    try:
+        repository.upload_packages(packages)
+    finally:
+        # Projects that were published are added to the catalog even if others failed
+        repository.update_index()
+        _log_writes(repository)
+
+
+def _log_writes(repository):
+    logger.info('Uploaded {0} index objects, skipped {1} unchanged'.format(repository.objects_written, repository.objects_skipped))
+
+
+def _report_stats(ctx, repository, stats, stats_file):
+    if stats:
+        for line in repository.stats.format_summary():
+            logger.info(line)
+
+    if stats_file:
+        json.dump({
+            'command': ctx.info_name,
+            'objects_skipped': repository.objects_skipped,
+            'objects_written': repository.objects_written,
+            'operations': repository.stats.get_stats(),
+            }, stats_file, indent=2)
+        stats_file.write('\n')
+
+
 @click.group()
 @click.option(
     '--version',
@@ -79,15 +145,39 @@ def cli():
 @click.option('--baseurl', help='Use an alternate base URL, instead of the S3 Bucket address.', default=None, callback=_check_url)
 @click.option('--prefix', help='Prefix within the S3 Bucket that repository objects are stored.', default='simple', show_default=True, callback=_check_prefix)
 @click.option('--profile', help='Use a specific profile from your credential file to access S3.', default=None)
+@click.option('--local-dir', help='Store repository objects in a local directory instead of the S3 Bucket.', default=None,
+              type=click.Path(file_okay=False))
+@click.option('--cache-dir', help='Directory used to cache project manifests and compiled templates between runs.  [default: no cache]', default=None,
+              envvar='STICK_CACHE_DIR', type=click.Path(file_okay=False))
+@click.option('--cache-size', help='Maximum size of the manifest cache, in megabytes.', default=512, show_default=True, type=click.IntRange(min=1))
+@click.option('--stats/--no-stats', help='Print request counts and timings when finished.', default=False, show_default=True)
+@click.option('--stats-file', help='Write request counts and timings to a file as JSON.', default=None, type=click.File('w'))
 @click.option('--skip-existing/--no-skip-existing', help='Skip uploading file if it already exists.', default=True, show_default=True)
 @click.option('--sign/--no-sign', help='Sign files prior to upload using GPG.', default=False, show_default=True)
 @click.option('--sign-with', help='GPG program used to sign uploads.', default='gpg', show_default=True)
 @click.option('--identity', help='GPG identity used to sign uploads.')
+@click.option('--jobs', help='Number of files to upload concurrently.', default=1, show_default=True, type=click.IntRange(min=1))
+@click.option('--processes', help='Number of processes used to hash and parse distributions before upload.  [default: number of CPUs]', default=None,
+              type=click.IntRange(min=1))
+@click.option('--max-requests', help='Maximum number of concurrent requests used to update index objects.', default=10, show_default=True,
+              type=click.IntRange(min=1))
+@click.option('--manifest-format', help='Format used when writing project manifests.', default='legacy', show_default=True,
+              type=click.Choice(MANIFEST_FORMATS))
+@click.option('--simple-json-prefix', help='Also publish PEP 691 JSON simple index pages under this prefix within the S3 Bucket.  [default: disabled]',
+              default=None, callback=_check_prefix)
+@click.option('--compress', help='Content encoding used to compress HTML and JSON index pages.', default='none', show_default=True,
+              type=click.Choice(compression.CONTENT_ENCODINGS), callback=_check_compress)
+@click.option('--cache-control', help='Cache-Control header set on HTML and JSON index pages.  [default: none]', default=None)
+@click.option('--recent-versions', help='List only this many of the most recent versions in project indexes, and publish the full history in pages.'
+              '  [default: all versions]', default=None, type=click.IntRange(min=1))
+@click.option('--page-size', help='Number of versions on each page of the project history.', default=100, show_default=True, type=click.IntRange(min=1))
 @click.argument('dist', nargs=-1, type=click.Path(exists=True, dir_okay=False, allow_dash=False))
 @click.pass_context
-def upload(ctx, dist, **kwargs):
+def upload(ctx, dist, stats, stats_file, **kwargs):
     """Upload one or more files to the repository."""
-    _check_profile(ctx, 'profile', kwargs['profile'])
+    if not kwargs['local_dir']:
+        _check_profile(ctx, 'profile', kwargs['profile'])
+    _check_simple_json_prefix(kwargs)
     upload_settings = Settings(**kwargs)
     repository = upload_settings.create_repository()
     signatures = dict((os.path.basename(d), d) for d in dist if d.endswith('.asc'))
@@ -95,26 +185,74 @@ def upload(ctx, dist, **kwargs):
 
     logger.info('Uploading distributions to {0}'.format(repository.get_url()))
 
-    uploaded = 0
-    for filename in uploads:
-        package = PackageFile.from_filename(filename, '')
-        skip_message = 'Skipping {0} because it appears to already exist'.format(package.basefilename)
+    try:
+        packages = []
+        for package in prepare_packages(uploads, upload_settings.processes):
+            skip_message = 'Skipping {0} because it appears to already exist'.format(package.basefilename)
 
-        if upload_settings.skip_existing and repository.package_is_uploaded(package):
-            logger.info(skip_message)
-            continue
+            if upload_settings.skip_existing and repository.package_is_uploaded(package):
+                logger.info(skip_message)
+                continue
 
-        signed_name = package.signed_basefilename
-        if signed_name in signatures:
-            package.add_gpg_signature(signatures[signed_name], signed_name)
-        elif upload_settings.sign:
-            package.sign(upload_settings.sign_with, upload_settings.identity)
+            packages.append(package)
 
-        repository.upload(package)
-        uploaded += 1
+        _upload_packages(upload_settings, repository, packages, signatures)
+    finally:
+        _report_stats(ctx, repository, stats, stats_file)
 
-    if uploaded:
-        repository.update_index()
+
+@cli.command(context_settings={'max_content_width': 120})
+@click.option('--bucket', help='S3 Bucket hosting the repository.', required=True)
+@click.option('--baseurl', help='Use an alternate base URL, instead of the S3 Bucket address.', default=None, callback=_check_url)
+@click.option('--prefix', help='Prefix within the S3 Bucket that repository objects are stored.', default='simple', show_default=True, callback=_check_prefix)
+@click.option('--profile', help='Use a specific profile from your credential file to access S3.', default=None)
+@click.option('--local-dir', help='Store repository objects in a local directory instead of the S3 Bucket.', default=None,
+              type=click.Path(file_okay=False))
+@click.option('--cache-dir', help='Directory used to cache project manifests and compiled templates between runs.  [default: no cache]', default=None,
+              envvar='STICK_CACHE_DIR', type=click.Path(file_okay=False))
+@click.option('--cache-size', help='Maximum size of the manifest cache, in megabytes.', default=512, show_default=True, type=click.IntRange(min=1))
+@click.option('--stats/--no-stats', help='Print request counts and timings when finished.', default=False, show_default=True)
+@click.option('--stats-file', help='Write request counts and timings to a file as JSON.', default=None, type=click.File('w'))
+@click.option('--sign/--no-sign', help='Sign files prior to upload using GPG.', default=False, show_default=True)
+@click.option('--sign-with', help='GPG program used to sign uploads.', default='gpg', show_default=True)
+@click.option('--identity', help='GPG identity used to sign uploads.')
+@click.option('--jobs', help='Number of files to upload concurrently.', default=1, show_default=True, type=click.IntRange(min=1))
+@click.option('--processes', help='Number of processes used to hash and parse distributions before upload.  [default: number of CPUs]', default=None,
+              type=click.IntRange(min=1))
+@click.option('--max-requests', help='Maximum number of concurrent requests used to update index objects.', default=10, show_default=True,
+              type=click.IntRange(min=1))
+@click.option('--manifest-format', help='Format used when writing project manifests.', default='legacy', show_default=True,
+              type=click.Choice(MANIFEST_FORMATS))
+@click.option('--simple-json-prefix', help='Also publish PEP 691 JSON simple index pages under this prefix within the S3 Bucket.  [default: disabled]',
+              default=None, callback=_check_prefix)
+@click.option('--compress', help='Content encoding used to compress HTML and JSON index pages.', default='none', show_default=True,
+              type=click.Choice(compression.CONTENT_ENCODINGS), callback=_check_compress)
+@click.option('--cache-control', help='Cache-Control header set on HTML and JSON index pages.  [default: none]', default=None)
+@click.option('--recent-versions', help='List only this many of the most recent versions in project indexes, and publish the full history in pages.'
+              '  [default: all versions]', default=None, type=click.IntRange(min=1))
+@click.option('--page-size', help='Number of versions on each page of the project history.', default=100, show_default=True, type=click.IntRange(min=1))
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.pass_context
+def sync(ctx, directory, stats, stats_file, **kwargs):
+    """Upload new and changed files within a directory tree to the repository."""
+    if not kwargs['local_dir']:
+        _check_profile(ctx, 'profile', kwargs['profile'])
+    _check_simple_json_prefix(kwargs)
+    upload_settings = Settings(**kwargs)
+    repository = upload_settings.create_repository()
+    filenames = find_distributions(directory)
+    signatures = dict((os.path.basename(f), f) for f in filenames if f.endswith('.asc'))
+    uploads = [f for f in filenames if not f.endswith('.asc')]
+
+    logger.info('Syncing {0} to {1}'.format(directory, repository.get_url()))
+
+    try:
+        packages = repository.get_changed_packages(prepare_packages(uploads, upload_settings.processes))
+        logger.info('Found {0} new or changed files out of {1}'.format(len(packages), len(uploads)))
+
+        _upload_packages(upload_settings, repository, packages, signatures)
+    finally:
+        _report_stats(ctx, repository, stats, stats_file)
 
 
 @cli.command(context_settings={'max_content_width': 120})
@@ -122,18 +260,61 @@ def upload(ctx, dist, **kwargs):
 @click.option('--baseurl', help='Use an alternate base URL, instead of the S3 Bucket address.', default=None, callback=_check_url)
 @click.option('--prefix', help='Prefix within the S3 Bucket that repository objects are stored.', default='simple', show_default=True, callback=_check_prefix)
 @click.option('--profile', help='Use a specific profile from your credential file to access S3.', default=None)
+@click.option('--local-dir', help='Store repository objects in a local directory instead of the S3 Bucket.', default=None,
+              type=click.Path(file_okay=False))
+@click.option('--cache-dir', help='Directory used to cache project manifests and compiled templates between runs.  [default: no cache]', default=None,
+              envvar='STICK_CACHE_DIR', type=click.Path(file_okay=False))
+@click.option('--cache-size', help='Maximum size of the manifest cache, in megabytes.', default=512, show_default=True, type=click.IntRange(min=1))
+@click.option('--stats/--no-stats', help='Print request counts and timings when finished.', default=False, show_default=True)
+@click.option('--stats-file', help='Write request counts and timings to a file as JSON.', default=None, type=click.File('w'))
 @click.option('--project', help='Reindex a specific project. May be specified multiple times.  [default: all projects]', default=None, multiple=True)
+@click.option('--jobs', help='Number of projects to reindex concurrently.', default=1, show_default=True, type=click.IntRange(min=1))
+@click.option('--downloads', help='Maximum number of packages to download concurrently.  [default: same as --jobs]', default=None, type=click.IntRange(min=1))
+@click.option('--max-requests', help='Maximum number of concurrent requests used to update index objects.', default=10, show_default=True,
+              type=click.IntRange(min=1))
+@click.option('--manifest-format', help='Format used when writing project manifests.', default='legacy', show_default=True,
+              type=click.Choice(MANIFEST_FORMATS))
+@click.option('--simple-json-prefix', help='Also publish PEP 691 JSON simple index pages under this prefix within the S3 Bucket.  [default: disabled]',
+              default=None, callback=_check_prefix)
+@click.option('--compress', help='Content encoding used to compress HTML and JSON index pages.', default='none', show_default=True,
+              type=click.Choice(compression.CONTENT_ENCODINGS), callback=_check_compress)
+@click.option('--cache-control', help='Cache-Control header set on HTML and JSON index pages.  [default: none]', default=None)
+@click.option('--recent-versions', help='List only this many of the most recent versions in project indexes, and publish the full history in pages.'
+              '  [default: all versions]', default=None, type=click.IntRange(min=1))
+@click.option('--page-size', help='Number of versions on each page of the project history.', default=100, show_default=True, type=click.IntRange(min=1))
+@click.option('--metadata-only/--no-metadata-only', help='Only read package metadata for files that are unchanged since the last index.',
+              default=False, show_default=True)
+@click.option('--journal', help='Record reindex progress in this file, so that an interrupted reindex can be resumed.', default=None,
+              type=click.Path(dir_okay=False, writable=True))
+@click.option('--resume/--no-resume', help='Skip projects and files already recorded in the journal.', default=False, show_default=True)
 @click.pass_context
-def reindex(ctx, project, **kwargs):
+def reindex(ctx, project, metadata_only, journal, resume, stats, stats_file, **kwargs):
     """Reindex all packages within the repository, ignoring any existing metadata."""
-    _check_profile(ctx, 'profile', kwargs['profile'])
+    if not kwargs['local_dir']:
+        _check_profile(ctx, 'profile', kwargs['profile'])
+    _check_simple_json_prefix(kwargs)
     upload_settings = Settings(**kwargs)
     repository = upload_settings.create_repository()
 
+    if resume and not journal:
+        raise click.BadParameter('a journal is required to resume', param_hint='resume')
+    if journal:
+        try:
+            journal = Journal(journal, repository.get_url(), resume)
+        except ValueError as e:
+            raise click.BadParameter('{}'.format(e), param_hint='journal')
+
     logger.info('Reindexing {0}'.format(repository.get_url()))
 
-    repository.reindex(project)
-    repository.update_index()
+    try:
+        succeeded = repository.reindex(project, metadata_only, journal)
+        _log_writes(repository)
+    finally:
+        _report_stats(ctx, repository, stats, stats_file)
+
+    if journal:
+        # The journal is kept if any project failed, so that rerunning with --resume only retries the failed projects
+        journal.close(remove=succeeded)
 
 
 @cli.command(context_settings={'max_content_width': 120})
@@ -141,17 +322,101 @@ def reindex(ctx, project, **kwargs):
 @click.option('--baseurl', help='Use an alternate base URL, instead of the S3 Bucket address.', default=None, callback=_check_url)
 @click.option('--prefix', help='Prefix within the S3 Bucket that repository objects are stored.', default='simple', show_default=True, callback=_check_prefix)
 @click.option('--profile', help='Use a specific profile from your credential file to access S3.', default=None)
+@click.option('--local-dir', help='Store repository objects in a local directory instead of the S3 Bucket.', default=None,
+              type=click.Path(file_okay=False))
+@click.option('--cache-dir', help='Directory used to cache project manifests and compiled templates between runs.  [default: no cache]', default=None,
+              envvar='STICK_CACHE_DIR', type=click.Path(file_okay=False))
+@click.option('--cache-size', help='Maximum size of the manifest cache, in megabytes.', default=512, show_default=True, type=click.IntRange(min=1))
+@click.option('--stats/--no-stats', help='Print request counts and timings when finished.', default=False, show_default=True)
+@click.option('--stats-file', help='Write request counts and timings to a file as JSON.', default=None, type=click.File('w'))
 @click.option('--project', help='Check a specific project. May be specified multiple times.  [default: all projects]', default=None, multiple=True)
+@click.option('--jobs', help='Number of projects to check concurrently.', default=1, show_default=True, type=click.IntRange(min=1))
 @click.pass_context
-def check(ctx, project, **kwargs):
+def check(ctx, project, stats, stats_file, **kwargs):
     """Check for missing or changed packages."""
-    _check_profile(ctx, 'profile', kwargs['profile'])
+    if not kwargs['local_dir']:
+        _check_profile(ctx, 'profile', kwargs['profile'])
     upload_settings = Settings(**kwargs)
     repository = upload_settings.create_repository()
 
     logger.info('Checking {0}'.format(repository.get_url()))
 
-    repository.check(project)
+    try:
+        repository.check(project)
+    finally:
+        _report_stats(ctx, repository, stats, stats_file)
+
+
+@cli.command(context_settings={'max_content_width': 120})
+@click.option('--bucket', help='S3 Bucket hosting the repository.', required=True)
+@click.option('--baseurl', help='Use an alternate base URL, instead of the S3 Bucket address.', default=None, callback=_check_url)
+@click.option('--prefix', help='Prefix within the S3 Bucket that repository objects are stored.', default='simple', show_default=True, callback=_check_prefix)
+@click.option('--profile', help='Use a specific profile from your credential file to access S3.', default=None)
+@click.option('--local-dir', help='Local directory containing the repository objects to publish.', required=True, type=click.Path(exists=True, file_okay=False))
+@click.option('--stats/--no-stats', help='Print request counts and timings when finished.', default=False, show_default=True)
+@click.option('--stats-file', help='Write request counts and timings to a file as JSON.', default=None, type=click.File('w'))
+@click.option('--jobs', help='Number of package files to upload concurrently.', default=1, show_default=True, type=click.IntRange(min=1))
+@click.option('--max-requests', help='Maximum number of concurrent requests used to upload index objects.', default=10, show_default=True,
+              type=click.IntRange(min=1))
+@click.option('--simple-json-prefix', help='Also publish PEP 691 JSON simple index pages from this prefix within the local directory.  [default: disabled]',
+              default=None, callback=_check_prefix)
+@click.pass_context
+def publish(ctx, stats, stats_file, **kwargs):
+    """Copy a repository built in a local directory to the S3 Bucket."""
+    _check_profile(ctx, 'profile', kwargs['profile'])
+    _check_simple_json_prefix(kwargs)
+    upload_settings = Settings(**kwargs)
+    repository = upload_settings.create_repository()
+
+    logger.info('Publishing {0} to {1}'.format(upload_settings.local_dir, repository.get_url()))
+
+    try:
+        repository.publish_to(upload_settings.create_bucket_storage())
+        _log_writes(repository)
+    finally:
+        _report_stats(ctx, repository, stats, stats_file)
+
+
+@cli.command(context_settings={'max_content_width': 120})
+@click.option('--bucket', help='S3 Bucket hosting the repository.', required=True)
+@click.option('--baseurl', help='Use an alternate base URL, instead of the S3 Bucket address.', default=None, callback=_check_url)
+@click.option('--prefix', help='Prefix within the S3 Bucket that repository objects are stored.', default='simple', show_default=True, callback=_check_prefix)
+@click.option('--profile', help='Use a specific profile from your credential file to access S3.', default=None)
+@click.option('--local-dir', help='Serve repository objects from a local directory instead of the S3 Bucket.', default=None,
+              type=click.Path(file_okay=False))
+@click.option('--cache-dir', help='Directory used to cache repository objects between requests.', required=True,
+              envvar='STICK_CACHE_DIR', type=click.Path(file_okay=False))
+@click.option('--cache-size', help='Maximum size of the cache, in megabytes.', default=512, show_default=True, type=click.IntRange(min=1))
+@click.option('--stats/--no-stats', help='Print request counts and timings when stopped.', default=False, show_default=True)
+@click.option('--stats-file', help='Write request counts and timings to a file as JSON when stopped.', default=None, type=click.File('w'))
+@click.option('--simple-json-prefix', help='Also serve PEP 691 JSON simple index pages from this prefix within the S3 Bucket.  [default: disabled]',
+              default=None, callback=_check_prefix)
+@click.option('--host', help='Address to listen on.', default='127.0.0.1', show_default=True)
+@click.option('--port', help='Port to listen on.', default=8080, show_default=True, type=click.IntRange(min=0, max=65535))
+@click.option('--revalidate-after', help='Number of seconds to serve cached objects before checking the S3 Bucket for changes.', default=60,
+              show_default=True, type=click.IntRange(min=0))
+@click.option('--rewrite-urls/--no-rewrite-urls', help='Rewrite links in index pages to point at this server, so that packages are downloaded through it.',
+              default=True, show_default=True)
+@click.pass_context
+def serve(ctx, host, port, revalidate_after, rewrite_urls, stats, stats_file, **kwargs):
+    """Serve the repository over HTTP through a local read-through cache."""
+    from .server import CachingProxy, ProxyServer
+    if not kwargs['local_dir']:
+        _check_profile(ctx, 'profile', kwargs['profile'])
+    _check_simple_json_prefix(kwargs)
+    upload_settings = Settings(**kwargs)
+    repository = upload_settings.create_repository()
+    server = ProxyServer((host, port), CachingProxy(repository, revalidate_after), rewrite_urls)
+
+    logger.info('Serving {0} at http://{1}:{2}/{3}'.format(repository.get_url(), host, server.server_address[1], repository.prefix))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        _report_stats(ctx, repository, stats, stats_file)
 
 
 logging.basicConfig(level='INFO', format='%(message)s', stream=sys.stdout)
@@ -0,0 +1,48 @@
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CONTENT_ENCODINGS = ['none', 'gzip', 'br']
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def make_compressor(content_encoding):
+    """Return an object with compress(data) and flush() methods that produces content in the given encoding"""
+    if content_encoding == 'gzip':
+        # zlib writes a gzip header without a timestamp, so identical content always compresses identically
+        return zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif content_encoding == 'br':
+        _require_brotli()
+        return _BrotliCompressor()
+    raise ValueError('Unsupported content encoding {0}'.format(content_encoding))
+
+
+def decompress(data, content_encoding=None):
+    """Decode content stored with the given encoding. Gzip content is recognised even if its encoding was not recorded."""
+    if content_encoding == 'gzip' or (content_encoding in (None, 'identity') and data[:2] == GZIP_MAGIC):
+        return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+    elif content_encoding == 'br':
+        _require_brotli()
+        return brotli.decompress(data)
+    elif content_encoding not in (None, 'identity'):
+        raise ValueError('Unsupported content encoding {0}'.format(content_encoding))
+    return data
+
+
+def _require_brotli():
+    if brotli is None:
+        raise ValueError('The brotli package is required for brotli content encoding; install stick[brotli]')
+
+
+class _BrotliCompressor(object):
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=11)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
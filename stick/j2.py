@@ -1,10 +1,49 @@
+import errno
 import os
-
-import jinja2
+import threading
 
 from . import util
 
 templates = os.path.join(os.path.dirname(__file__), 'templates')
-loader = jinja2.FileSystemLoader(templates)
-environ = jinja2.Environment(loader=loader)
-environ.globals['util'] = util
+
+_bytecode_cache_dir = None
+_environ = None
+_templates = {}
+_lock = threading.Lock()
+
+
+def configure(bytecode_cache_dir=None):
+    """Set the directory in which compiled templates are cached between runs. Must be called before any template is loaded."""
+    global _bytecode_cache_dir
+    if bytecode_cache_dir:
+        try:
+            os.makedirs(bytecode_cache_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise e
+    _bytecode_cache_dir = bytecode_cache_dir
+
+
+def get_template(name):
+    """Return a compiled template, loading it on first use only.
+
+    Templates are shipped with the package and do not change while running, so they are not checked for
+    modifications once loaded.
+    """
+    template = _templates.get(name)
+    if template is None:
+        with _lock:
+            template = _templates.get(name)
+            if template is None:
+                template = _templates[name] = _get_environ().get_template(name)
+    return template
+
+
+def _get_environ():
+    global _environ
+    if _environ is None:
+        import jinja2
+        bytecode_cache = jinja2.FileSystemBytecodeCache(_bytecode_cache_dir) if _bytecode_cache_dir else None
+        _environ = jinja2.Environment(loader=jinja2.FileSystemLoader(templates), auto_reload=False, bytecode_cache=bytecode_cache)
+        _environ.globals['util'] = util
+    return _environ
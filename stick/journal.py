@@ -0,0 +1,90 @@
+import json
+import logging
+import os
+import threading
+
+JOURNAL_FORMAT = 1
+
+logger = logging.getLogger(__name__)
+
+
+class Journal(object):
+    """Append-only record of reindex progress, used to resume a reindex that was interrupted.
+
+    The journal is a file of JSON lines: a header naming the repository, followed by the package info extracted from
+    each file, and the catalog entry of each project once it has been published. Every line is flushed as it is written,
+    so an interrupted run loses at most the line being written, which is discarded when the journal is loaded.
+    """
+    def __init__(self, path, url, resume=False):
+        self.path = path
+        self.url = url
+        self._lock = threading.Lock()
+        self._packages = {}
+        self._projects = {}
+
+        offset = self._load() if resume and os.path.exists(path) else 0
+        if offset:
+            # Drop any partial line left by the interrupted run, so that new records start on a line of their own
+            with open(path, 'r+b') as journal:
+                journal.truncate(offset)
+            self._file = open(path, 'ab')
+        else:
+            self._file = open(path, 'wb')
+            self._write({'format': JOURNAL_FORMAT, 'url': url})
+
+    def is_complete(self, safe_name):
+        return safe_name in self._projects
+
+    def get_packages(self, safe_name):
+        """Return the package info recorded for each file in a project, keyed by filename"""
+        return dict(self._packages.get(safe_name, {}))
+
+    def get_catalog(self):
+        """Return the catalog entries of completed projects that contain packages"""
+        return dict((safe_name, entry) for safe_name, entry in self._projects.items() if entry is not None)
+
+    def add_package(self, safe_name, package_info):
+        self._packages.setdefault(safe_name, {})[package_info['filename']] = package_info
+        self._write({'project': safe_name, 'package': package_info})
+
+    def complete_project(self, safe_name, catalog_entry):
+        """Record that a project has been published, with its catalog entry, or None if it contains no packages"""
+        self._projects[safe_name] = catalog_entry
+        self._write({'project': safe_name, 'catalog': catalog_entry})
+
+    def close(self, remove=False):
+        """Close the journal, removing it if the reindex it records is finished"""
+        self._file.close()
+        if remove:
+            os.unlink(self.path)
+
+    def _load(self):
+        """Load the records of an earlier run, returning the offset of the end of the last complete record"""
+        offset = 0
+        with open(self.path, 'rb') as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line.decode('utf-8')) if line.endswith(b'\n') else None
+                except ValueError:
+                    record = None
+                if record is None:
+                    logger.warn('Ignoring incomplete record at the end of journal {0}'.format(self.path))
+                    break
+
+                if offset == 0:
+                    if record.get('format') != JOURNAL_FORMAT or record.get('url') != self.url:
+                        raise ValueError('Journal {0} does not record a reindex of {1}'.format(self.path, self.url))
+                elif 'package' in record:
+                    self._packages.setdefault(record['project'], {})[record['package']['filename']] = record['package']
+                else:
+                    self._projects[record['project']] = record['catalog']
+                offset += len(line)
+
+        logger.info('Resuming reindex with {0} completed projects from journal {1}'.format(len(self._projects), self.path))
+        return offset
+
+    def _write(self, record):
+        line = json.dumps(record, sort_keys=True) + '\n'
+        with self._lock:
+            self._file.write(line.encode('utf-8'))
+            self._file.flush()
@@ -0,0 +1,60 @@
+import json
+
+from .compression import decompress
+
+MANIFEST_FORMAT = 2
+MANIFEST_FORMATS = ['legacy', 'compact', 'compact-gzip']
+
+# Fields that differ between the files of a release, and are therefore always stored with each file
+FILE_FIELDS = [
+    'comment_text', 'digests', 'etag', 'filename', 'has_sig', 'md5_digest',
+    'packagetype', 'python_version', 'size', 'upload_time', 'version']
+
+
+def encode_manifest(package_infos, manifest_format='legacy'):
+    """Yield the JSON encoding of a manifest in chunks.
+
+    The legacy format is a list of complete package info dicts. The compact format stores the fields shared by
+    all files of a version once per version, and only the remaining fields with each file.
+    """
+    if manifest_format == 'legacy':
+        return json.JSONEncoder().iterencode(package_infos)
+    # Keys are sorted so that the encoding of an unchanged manifest is stable, and its upload can be skipped
+    return json.JSONEncoder(sort_keys=True).iterencode(_compact_manifest(package_infos))
+
+
+def decode_manifest(data, content_encoding=None):
+    """Load a manifest in either format, from JSON that may be compressed, returning a list of package info dicts"""
+    data = decompress(data, content_encoding)
+    manifest = json.loads(data.decode('utf-8'))
+    if isinstance(manifest, list):
+        return manifest
+    if manifest.get('format') != MANIFEST_FORMAT:
+        raise ValueError('Unsupported manifest format {0}'.format(manifest.get('format')))
+
+    # Entries for the same version share the common field values rather than holding copies of them
+    versions = manifest['versions']
+    package_infos = []
+    for entry in manifest['files']:
+        package_info = dict(versions[entry['version']])
+        package_info.update(entry)
+        package_infos.append(package_info)
+    return package_infos
+
+
+def _compact_manifest(package_infos):
+    versions = {}
+    for package_info in package_infos:
+        versions.setdefault(package_info['version'], []).append(package_info)
+
+    common = {}
+    for version, infos in versions.items():
+        keys = set(infos[0]).difference(FILE_FIELDS)
+        common[version] = dict((k, infos[0][k]) for k in keys if all(k in p and p[k] == infos[0][k] for p in infos[1:]))
+
+    files = []
+    for package_info in package_infos:
+        shared = common[package_info['version']]
+        files.append(dict((k, v) for k, v in package_info.items() if k not in shared))
+
+    return {'format': MANIFEST_FORMAT, 'versions': common, 'files': files}
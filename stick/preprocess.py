@@ -0,0 +1,50 @@
+import logging
+import multiprocessing
+import os
+from concurrent import futures
+
+logger = logging.getLogger(__name__)
+
+
+def find_distributions(directory):
+    """Return the paths of all distribution files and their signatures within a directory tree, in sorted order"""
+    from twine.package import DIST_EXTENSIONS
+
+    extensions = tuple(DIST_EXTENSIONS) + tuple(extension + '.asc' for extension in DIST_EXTENSIONS)
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        # Skip hidden directories, such as version control metadata
+        dirnames[:] = [dirname for dirname in dirnames if not dirname.startswith('.')]
+        paths.extend(os.path.join(dirpath, filename) for filename in filenames if filename.endswith(extensions))
+    return sorted(paths)
+
+
+def prepare_packages(filenames, processes=None):
+    """Read, hash and parse the metadata of distribution files in a pool of processes.
+
+    Returns a PackageFile for each file, in the same order as the filenames, with its size recorded.
+    """
+    processes = min(processes or multiprocessing.cpu_count(), len(filenames))
+    if processes <= 1:
+        return [_prepare_package(filename) for filename in filenames]
+
+    with futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(_prepare_package, filenames))
+
+
+def sign_packages(packages, sign_with, identity, jobs=1):
+    """Sign packages concurrently. Signing runs in separate GPG processes, so threads are sufficient."""
+    with futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        for package, future in [(package, executor.submit(package.sign, sign_with, identity)) for package in packages]:
+            future.result()
+            logger.info('Signed {0}'.format(package.basefilename))
+
+
+def _prepare_package(filename):
+    # Imported here so that worker processes do not need to import twine until they are used
+    from twine.package import PackageFile
+
+    # PackageFile computes all of its digests in a single pass over the file
+    package = PackageFile.from_filename(filename, '')
+    package.size = os.path.getsize(filename)
+    return package
@@ -1,7 +1,10 @@
-from collections import OrderedDict, defaultdict
+import bisect
+import json
+from collections import OrderedDict
 from datetime import datetime
 from os.path import getsize
 
+from packaging.utils import canonicalize_name
 from packaging.version import parse
 
 RELEASE_FIELDS = [
@@ -12,45 +15,154 @@ INFO_FIELDS = [
     'description_content_type', 'home_page', 'keywords', 'license',
     'maintainer', 'maintainer_email', 'name', 'platform', 'project_urls',
     'requires_dist', 'requires_python', 'summary', 'version']
+SIMPLE_API_VERSION = '1.0'
 URL_FIELDS = [
     'comment_text', 'digests', 'filename', 'has_sig', 'md5_digest',
     'packagetype', 'python_version', 'requires_python', 'size', 'upload_time']
 
 
 class Project(object):
-    def __init__(self, safe_name, repository, manifest=[]):
+    def __init__(self, safe_name, repository, manifest=None, etag=None):
         self.safe_name = safe_name
         self.repository = repository
-        self.manifest = manifest
-        self.releases = defaultdict(list)
-        self._rebuild_releases()
+        self.etag = etag
+        self.releases = {}
+        self._files = OrderedDict()
+        self._versions = []
+        self._parsed_versions = {}
+        self.add_package_infos(manifest or [])
+
+    @property
+    def manifest(self):
+        return list(self._files.values())
+
+    @property
+    def latest_version(self):
+        return self._versions[-1] if self._versions else None
 
     def get_manifest(self):
         return self.manifest
 
-    def get_metadata(self, version=None):
+    def get_package_info(self, filename):
+        return self._files.get(filename)
+
+    def get_metadata(self, version=None, versions=None):
         return OrderedDict([
             ('info', self.get_info(version)),
             ('last_serial', -1),
-            ('releases', self.get_releases()),
+            ('releases', self.get_releases(versions)),
             ('urls', self.get_urls(version)),
             ])
 
-    def get_releases(self):
-        return OrderedDict((str(v), [self._make_release(p) for p in self.releases[v]]) for v in sorted(self.releases.keys()))
+    def get_releases(self, versions=None):
+        return OrderedDict((version, list(releases)) for version, releases in self.iter_releases(versions))
+
+    def iter_releases(self, versions=None):
+        """Yield (version, releases) for each version in order, generating the release entries only as they are consumed.
+
+        If a list of versions is given, only those versions are included.
+        """
+        for version in self._versions if versions is None else versions:
+            yield str(version), (self._make_release(p) for p in self.releases[version])
+
+    def get_recent_versions(self, count):
+        """Return the most recent versions, oldest first"""
+        return self._versions[-count:]
+
+    def get_page_count(self, page_size):
+        return (len(self._versions) + page_size - 1) // page_size
+
+    def get_page_versions(self, page_size, page):
+        """Return the versions on a page of the version history, with pages numbered from zero starting at the oldest version"""
+        return self._versions[page * page_size:(page + 1) * page_size]
+
+    def get_page_number(self, page_size, version):
+        """Return the number of the history page that contains, or would contain, a version"""
+        return bisect.bisect_left(self._versions, self._parse_version(version)) // page_size
+
+    def iter_metadata_json(self, version=None, versions=None):
+        """Yield the JSON encoding of get_metadata() in chunks, encoding one release at a time"""
+        encoder = json.JSONEncoder()
+        yield '{"info": '
+        for chunk in encoder.iterencode(self.get_info(version)):
+            yield chunk
+        yield ', "last_serial": -1, "releases": {'
+        for index, (release_version, releases) in enumerate(self.iter_releases(versions)):
+            yield '{0}{1}: ['.format(', ' if index else '', encoder.encode(release_version))
+            for release_index, release in enumerate(releases):
+                yield '{0}{1}'.format(', ' if release_index else '', encoder.encode(release))
+            yield ']'
+        yield '}, "urls": '
+        for chunk in encoder.iterencode(self.get_urls(version)):
+            yield chunk
+        yield '}'
+
+    def get_simple_index(self, versions=None):
+        """Return the PEP 691 JSON simple API page for this project, optionally listing only the given versions"""
+        files = []
+        for version in self._versions if versions is None else versions:
+            for package_info in self.releases[version]:
+                simple_file = OrderedDict([
+                    ('filename', package_info['filename']),
+                    ('url', self._get_package_url(package_info)),
+                    ('hashes', {'sha256': package_info['digests']['sha256']}),
+                    ])
+                if package_info.get('requires_python'):
+                    simple_file['requires-python'] = package_info['requires_python']
+                simple_file['gpg-sig'] = bool(package_info.get('has_sig'))
+                simple_file['yanked'] = False
+                files.append(simple_file)
+
+        return OrderedDict([
+            ('meta', {'api-version': SIMPLE_API_VERSION}),
+            ('name', canonicalize_name(self.safe_name)),
+            ('files', files),
+            ])
 
     def get_info(self, version=None):
-        version = parse(version) if version else max(self.releases.keys())
+        version = self._parse_version(version) if version else self.latest_version
         return self._make_info(self.releases[version][0])
 
     def get_urls(self, version=None):
-        version = parse(version) if version else max(self.releases.keys())
+        version = self._parse_version(version) if version else self.latest_version
         return [self._make_url(p) for p in self.releases[version]]
 
-    def add_package(self, package, upload_time=None, etag=None):
+    def add_package(self, package, upload_time=None, etag=None, size=None):
+        self.add_package_infos([self.make_package_info(package, upload_time, etag, size)])
+
+    def add_package_infos(self, package_infos):
+        """Add or replace several manifest entries at once, updating only the affected releases"""
+        versions = set()
+        for package_info in package_infos:
+            replaced = self._files.pop(package_info['filename'], None)
+            if replaced is not None:
+                version = self._parse_version(replaced['version'])
+                self.releases[version].remove(replaced)
+                versions.add(version)
+
+            version = self._parse_version(package_info['version'])
+            if version not in self.releases:
+                self.releases[version] = []
+                bisect.insort(self._versions, version)
+            self.releases[version].append(package_info)
+            self._files[package_info['filename']] = package_info
+            versions.add(version)
+
+        for version in versions:
+            if self.releases[version]:
+                self.releases[version].sort(key=lambda p: (p['packagetype'], p['filename']))
+            else:
+                del self.releases[version]
+                self._versions.remove(version)
+
+    def make_package_info(self, package, upload_time=None, etag=None, size=None):
         if upload_time is None:
             upload_time = datetime.utcnow()
-        package_info = {
+        if size is None:
+            size = getattr(package, 'size', None) or getsize(package.filename)
+        # Fail early on invalid versions, before the package is added to any release
+        self._parse_version(package.metadata.version)
+        return {
             'author': package.metadata.author,
             'author_email': package.metadata.author_email,
             'classifiers': package.metadata.classifiers,
@@ -72,29 +184,22 @@ class Project(object):
             'md5_digest': package.md5_digest,
             'name': package.metadata.name,
             'packagetype': package.filetype,
-            'platform': package.metadata.platforms[0],
+            'platform': package.metadata.platforms[0] if package.metadata.platforms else 'UNKNOWN',
             'project_urls': package.metadata.project_urls,
             'python_version': package.python_version,
             'requires_dist': package.metadata.requires_dist,
             'requires_python': package.metadata.requires_python,
-            'size': getsize(package.filename),
+            'size': size,
             'summary': package.metadata.summary,
             'upload_time': upload_time.strftime('%Y-%m-%dT%H:%m:%S'),
             'version': package.metadata.version,
              }
 
-        self.manifest = [p for p in self.manifest if p['filename'] != package_info['filename']]
-        self.manifest.append(package_info)
-        self._rebuild_releases()
-
-    def _rebuild_releases(self):
-        self.releases.clear()
-        for package_info in self.manifest:
-            version = parse(package_info['version'])
-            self.releases[version].append(package_info)
-
-        for package_list in self.releases.values():
-            package_list[:] = sorted(package_list, key=lambda p: (p['packagetype'], p['filename']))
+    def _parse_version(self, version):
+        parsed = self._parsed_versions.get(version)
+        if parsed is None:
+            parsed = self._parsed_versions[version] = parse(version)
+        return parsed
 
     def _make_release(self, package_info):
         release = OrderedDict((k, package_info[k]) for k in RELEASE_FIELDS)
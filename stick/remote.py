@@ -0,0 +1,168 @@
+import re
+import struct
+import zlib
+
+from pkginfo import Distribution
+
+EOCD_SIGNATURE = b'PK\x05\x06'
+EOCD_FORMAT = '<4s4H2LH'
+EOCD64_LOCATOR_SIGNATURE = b'PK\x06\x07'
+EOCD64_LOCATOR_FORMAT = '<4sLQL'
+EOCD64_SIGNATURE = b'PK\x06\x06'
+EOCD64_FORMAT = '<4sQ2H2L4Q'
+CENTRAL_SIGNATURE = b'PK\x01\x02'
+CENTRAL_FORMAT = '<4s6H3L5H2L'
+LOCAL_SIGNATURE = b'PK\x03\x04'
+LOCAL_FORMAT = '<4s5H3L2H'
+ZIP64_EXTRA_ID = 0x0001
+ZIP64_LIMIT = 0xFFFFFFFF
+
+# The end of central directory record is at most 22 bytes plus a 64k comment
+TAIL_SIZE = 65536 + struct.calcsize(EOCD_FORMAT)
+METADATA_RE = re.compile(r'^[^/]+\.dist-info/METADATA$')
+METADATA_FIELDS = [
+    'author', 'author_email', 'classifiers', 'description',
+    'description_content_type', 'home_page', 'keywords', 'license',
+    'maintainer', 'maintainer_email', 'name', 'project_urls',
+    'requires_dist', 'requires_python', 'summary', 'version']
+
+
+class RemotePackage(object):
+    """Stand-in for twine's PackageFile, built from an existing manifest entry instead of a local file"""
+    def __init__(self, safe_name, package_info, metadata, has_sig):
+        self.safe_name = safe_name
+        self.basefilename = package_info['filename']
+        self.signed_basefilename = self.basefilename + '.asc'
+        self.comment = package_info.get('comment_text')
+        self.filetype = package_info['packagetype']
+        self.python_version = package_info['python_version']
+        self.md5_digest = package_info['digests']['md5']
+        self.sha2_digest = package_info['digests']['sha256']
+        self.gpg_signature = (self.signed_basefilename, None) if has_sig else None
+        self.metadata = metadata
+
+
+def parse_metadata(data):
+    """Parse the contents of a METADATA or PKG-INFO file"""
+    metadata = Distribution()
+    metadata.parse(data)
+    return metadata
+
+
+def metadata_from_info(package_info):
+    """Rebuild package metadata from the fields stored in a manifest entry"""
+    metadata = Distribution()
+    for field in METADATA_FIELDS:
+        setattr(metadata, field, package_info.get(field))
+    metadata.platforms = [package_info.get('platform')]
+    return metadata
+
+
+def read_wheel_metadata(read_range, size):
+    """Return the contents of the dist-info METADATA file from a wheel, reading only the required byte ranges.
+
+    read_range is called with inclusive (start, end) offsets and must return the bytes in that range.
+    Raises ValueError if the file is not a valid wheel.
+    """
+    reader = _RangeReader(read_range, size)
+    cd_offset, cd_size = _find_central_directory(reader)
+    directory = reader.read(cd_offset, cd_size)
+
+    position = 0
+    while position + struct.calcsize(CENTRAL_FORMAT) <= len(directory):
+        header = struct.unpack_from(CENTRAL_FORMAT, directory, position)
+        if header[0] != CENTRAL_SIGNATURE:
+            raise ValueError('Corrupt zip central directory')
+
+        (method, compressed_size, name_length, extra_length, comment_length, offset) = (
+            header[4], header[8], header[10], header[11], header[12], header[16])
+        position += struct.calcsize(CENTRAL_FORMAT)
+        name = directory[position:position + name_length].decode('utf-8')
+        extra = directory[position + name_length:position + name_length + extra_length]
+        position += name_length + extra_length + comment_length
+
+        if METADATA_RE.match(name):
+            compressed_size, offset = _apply_zip64_extra(extra, header[9], compressed_size, offset)
+            return _read_member(reader, offset, compressed_size, method, name_length + extra_length)
+
+    raise ValueError('No dist-info METADATA found in wheel')
+
+
+def _find_central_directory(reader):
+    tail_offset = max(0, reader.size - TAIL_SIZE)
+    tail = reader.read(tail_offset, reader.size - tail_offset)
+    eocd = tail.rfind(EOCD_SIGNATURE)
+    if eocd == -1:
+        raise ValueError('No zip end of central directory record found')
+
+    cd_size, cd_offset = struct.unpack_from(EOCD_FORMAT, tail, eocd)[5:7]
+    if cd_offset != ZIP64_LIMIT and cd_size != ZIP64_LIMIT:
+        return cd_offset, cd_size
+
+    locator = eocd - struct.calcsize(EOCD64_LOCATOR_FORMAT)
+    if locator < 0 or tail[locator:locator + 4] != EOCD64_LOCATOR_SIGNATURE:
+        raise ValueError('No zip64 end of central directory locator found')
+
+    eocd64_offset = struct.unpack_from(EOCD64_LOCATOR_FORMAT, tail, locator)[2]
+    eocd64 = reader.read(eocd64_offset, struct.calcsize(EOCD64_FORMAT))
+    record = struct.unpack(EOCD64_FORMAT, eocd64)
+    if record[0] != EOCD64_SIGNATURE:
+        raise ValueError('Corrupt zip64 end of central directory record')
+    return record[9], record[8]
+
+
+def _apply_zip64_extra(extra, file_size, compressed_size, offset):
+    """Replace 32-bit sizes and offsets that overflowed with the values from the zip64 extra field"""
+    position = 0
+    while position + 4 <= len(extra):
+        header_id, data_size = struct.unpack_from('<2H', extra, position)
+        position += 4
+        if header_id == ZIP64_EXTRA_ID:
+            values = list(struct.unpack_from('<{0}Q'.format(data_size // 8), extra, position))
+            if file_size == ZIP64_LIMIT:
+                values.pop(0)
+            if compressed_size == ZIP64_LIMIT:
+                compressed_size = values.pop(0)
+            if offset == ZIP64_LIMIT:
+                offset = values.pop(0)
+            break
+        position += data_size
+    return compressed_size, offset
+
+
+def _read_member(reader, offset, compressed_size, method, names_size):
+    # Fetch the local header along with the data that is likely to follow it, to save a request
+    header_size = struct.calcsize(LOCAL_FORMAT)
+    header = struct.unpack(LOCAL_FORMAT, reader.read(offset, header_size, header_size + names_size + compressed_size + 1024))
+    if header[0] != LOCAL_SIGNATURE:
+        raise ValueError('Corrupt zip local file header')
+
+    data = reader.read(offset + header_size + header[9] + header[10], compressed_size)
+    if method == 0:
+        return data
+    elif method == 8:
+        try:
+            return zlib.decompressobj(-zlib.MAX_WBITS).decompress(data)
+        except zlib.error as e:
+            raise ValueError('Failed to decompress METADATA: {0}'.format(e))
+    raise ValueError('Unsupported zip compression method {0}'.format(method))
+
+
+class _RangeReader(object):
+    """Read byte ranges from a remote file, reusing the most recently fetched range when possible"""
+    def __init__(self, read_range, size):
+        self.read_range = read_range
+        self.size = size
+        self._offset = 0
+        self._buffer = b''
+
+    def read(self, offset, length, prefetch=0):
+        if offset < 0 or length < 0 or offset + length > self.size:
+            raise ValueError('Zip structure points outside of file')
+
+        if not (self._offset <= offset and offset + length <= self._offset + len(self._buffer)):
+            fetch = max(length, min(prefetch, self.size - offset))
+            self._offset = offset
+            self._buffer = self.read_range(offset, offset + fetch - 1) if fetch else b''
+        start = offset - self._offset
+        return self._buffer[start:start + length]
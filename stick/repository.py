@@ -1,120 +1,394 @@
-import codecs
-import io
+import hashlib
 import json
 import logging
+import mimetypes
 import os
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent import futures
+from contextlib import contextmanager
+from functools import partial
+from tempfile import SpooledTemporaryFile
 
-import boto3
 from backports import tempfile
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
+from packaging.utils import canonicalize_name
 from twine.exceptions import InvalidDistribution
 from twine.package import PackageFile
 
-from .j2 import environ
-from .project import Project
-from .util import client_config
+from .compression import GZIP_MAGIC, make_compressor
+from .j2 import get_template
+from .manifest import decode_manifest, encode_manifest
+from .project import SIMPLE_API_VERSION, Project
+from .remote import RemotePackage, metadata_from_info, parse_metadata, read_wheel_metadata
+from .stats import Stats
+from .storage import InstrumentedStorage, LocalStorage, S3Storage
+
+CATALOG_FORMAT = 1
+# Generated objects are held in memory up to this size, and spooled to disk beyond it
+SPOOL_SIZE = 8 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+SIMPLE_JSON_CONTENT_TYPE = 'application/vnd.pypi.simple.v1+json'
+# Errors returned by S3 when a conditional write finds that another writer has changed the object
+CONFLICT_CODES = ['404', '409', '412', 'NoSuchKey', 'ConditionalRequestConflict', 'PreconditionFailed']
+CONFLICT_RETRIES = 10
+RETRY_DELAY = 0.1
 
 logger = logging.getLogger(__name__)
 
 
 class Repository(object):
-    def __init__(self, bucket, baseurl, prefix, profile):
+    def __init__(self, bucket, baseurl, prefix, profile, jobs=1, downloads=None, cache=None, max_requests=10, storage=None,
+                 manifest_format='legacy', simple_json_prefix=None, content_encoding=None, cache_control=None, recent_versions=None,
+                 page_size=100):
         self.bucket = bucket
         self.baseurl = baseurl
         self.prefix = prefix
-        self.client = boto3.Session(profile_name=profile).client('s3', config=client_config)
+        self.jobs = jobs
+        self.cache = cache
+        self.manifest_format = manifest_format
+        self.simple_json_prefix = simple_json_prefix
+        self.content_encoding = content_encoding
+        self.cache_control = cache_control
+        self.recent_versions = recent_versions
+        self.page_size = page_size
+        self.download_slots = threading.BoundedSemaphore(downloads or jobs)
+        if storage is None:
+            # Each concurrent job may run a multipart transfer using several connections of its own,
+            # in addition to the connections used by the pool of index requests.
+            storage = S3Storage(bucket, profile, jobs * TransferConfig().max_concurrency + max_requests)
+        self.stats = Stats()
+        self.storage = InstrumentedStorage(storage, self.stats)
+        self.objects_written = 0
+        self.objects_skipped = 0
         self._project_cache = {}
+        self._etags = {}
+        self._reindexed = set()
+        self._published = set()
+        self._counter_lock = threading.Lock()
+        self._request_executor = futures.ThreadPoolExecutor(max_workers=max_requests)
 
     def get_url(self):
         baseurl = self.baseurl or 'https://{0}.s3.amazonaws.com/'.format(self.bucket)
         return baseurl + self.prefix
 
-    def reindex(self, projects):
-        """Rebuild html index and json metadata for projects in the repository"""
+    def reindex(self, projects, metadata_only=False, journal=None):
+        """Rebuild html index and json metadata for projects in the repository, returning False if any project failed.
+
+        If metadata_only is set, packages that are unchanged since the existing manifest was written are not downloaded.
+        If a journal is given, progress is recorded in it, and projects and packages already recorded are not processed again.
+        """
         all_projects = self._list_project_names()
+        if self.simple_json_prefix:
+            self._list_simple_json_pages()
+        existing = self._get_catalog()
+        catalog = existing if projects else None
+        page_headers = dict((safe_name, entry.get('page_headers')) for safe_name, entry in (existing or {}).items())
         if not projects:
             projects = all_projects[:]
 
-        for safe_name in projects:
+        succeeded = True
+        with futures.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            results = [(safe_name, executor.submit(self._reindex_project, safe_name, metadata_only, journal, page_headers.get(safe_name)))
+                       for safe_name in projects]
+            for safe_name, future in results:
+                try:
+                    if not future.result():
+                        try:
+                            all_projects.remove(safe_name)
+                        except ValueError:
+                            logger.warn('Project {0} not found'.format(safe_name))
+                except Exception:
+                    logger.error('Failed to reindex {}'.format(safe_name), exc_info=True)
+                    succeeded = False
+
+        if catalog is None:
+            catalog = self._build_catalog([p for p in all_projects if journal is None or not journal.is_complete(p)])
+        else:
+            for safe_name in set(catalog) - set(all_projects):
+                del catalog[safe_name]
+        if journal is not None:
+            # Projects published by an earlier run are not loaded, so their catalog entries are taken from the journal
+            catalog.update(journal.get_catalog())
+        self._update_catalog(catalog)
+        return succeeded
+
+    def _reindex_project(self, safe_name, metadata_only=False, journal=None, page_headers=None):
+        """Rebuild html index and json metadata for a single project, returning False if it contains no packages.
+
+        page_headers are the headers that the catalog records for the project's existing pages; if they differ from
+        the configured headers, every page is uploaded again, even if its content is unchanged.
+        """
+        if journal is not None and journal.is_complete(safe_name):
+            logger.info('Skipping {0}, which was reindexed by an earlier run'.format(safe_name))
+            return safe_name in journal.get_catalog()
+
+        known_packages = {}
+        if metadata_only:
+            known_packages = dict((p['filename'], p) for p in self._get_project(safe_name, bypass_cache=True).get_manifest())
+        journaled = journal.get_packages(safe_name) if journal is not None else {}
+
+        project = Project(safe_name, self)
+        package_infos = []
+        for package, s3meta in self._get_packages(safe_name, known_packages, journaled):
             try:
-                project = Project(safe_name, self)
-                for package, s3meta in self._get_packages(safe_name):
-                    try:
-                        version = package.metadata.version
-                        project.add_package(package, upload_time=s3meta['LastModified'], etag=s3meta['ETag'])
-                        self._put_json(safe_name, project, version)
-                        self._put_release(safe_name, project, version)
-                    except Exception:
-                        logger.error('Failed to add package {0}'.format(package.basefilename), exc_info=True)
-
-                if len(project.manifest):
-                    self._project_cache[safe_name] = project
-                    self._put_manifest(safe_name, project)
-                    self._put_json(safe_name, project)
-                    self._put_index(safe_name, project)
-                else:
-                    try:
-                        all_projects.remove(safe_name)
-                    except ValueError:
-                        logger.warn('Project {0} not found'.format(safe_name))
+                package_info = project.make_package_info(package, upload_time=s3meta['LastModified'], etag=s3meta['ETag'], size=s3meta['Size'])
             except Exception:
-                logger.error('Failed to reindex {}'.format(safe_name), exc_info=True)
-
-        self._update_repository_index(all_projects)
+                logger.error('Failed to add package {0}'.format(package.basefilename), exc_info=True)
+                continue
+            package_infos.append(package_info)
+            if journal is not None and journaled.get(package_info['filename']) != package_info:
+                journal.add_package(safe_name, package_info)
+
+        with self.stats.timer('project.add_packages'):
+            project.add_package_infos(package_infos)
+        self._project_cache[safe_name] = project
+        if not project.releases:
+            if journal is not None:
+                journal.complete_project(safe_name, None)
+            return False
+
+        if page_headers != self._get_page_headers():
+            self._forget_page_etags(safe_name)
+        self._publish_project(safe_name, set(p['version'] for p in project.manifest))
+        self._reindexed.add(safe_name)
+        if journal is not None:
+            journal.complete_project(safe_name, {'etag': project.etag, 'version': str(project.latest_version),
+                                                 'page_headers': self._get_page_headers()})
+        return True
 
     def check(self, projects):
+        """Compare project manifests against the files stored in the repository"""
         if not projects:
             projects = self._list_project_names()
 
-        for safe_name in projects:
-            project = self._get_project(safe_name)
-            if not project.manifest:
-                logger.warn('No packages in manifest for {0}'.format(safe_name))
-
-            for package_info in project.manifest:
-                s3meta = self._head_package(safe_name, package_info['filename'])
-                if not s3meta:
-                    logger.warn('File missing for {0}/{1}'.format(safe_name, package_info['filename']))
-                elif package_info.get('etag') != s3meta.get('ETag'):
-                    logger.warn('ETag changed for {0}/{1} - {2} -> {3}'.format(
-                        safe_name, package_info['filename'], package_info.get('etag'), s3meta.get('ETag')))
-                else:
-                    logger.info('Check OK for {0}/{1}'.format(safe_name, package_info['filename']))
+        with futures.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            results = [(safe_name, executor.submit(self._check_project, safe_name)) for safe_name in projects]
+            for safe_name, future in results:
+                try:
+                    future.result()
+                except Exception:
+                    logger.error('Failed to check {0}'.format(safe_name), exc_info=True)
+
+    def _check_project(self, safe_name):
+        """Compare a single project's manifest against a listing of its files"""
+        project = self._get_project(safe_name)
+        if not project.releases:
+            logger.warn('No packages in manifest for {0}'.format(safe_name))
+
+        prefix = '{0}{1}/'.format(self.prefix, safe_name)
+        s3metas = dict((item['Key'].replace(prefix, '', 1), item) for item in self._list_packages(safe_name))
+
+        for package_info in project.manifest:
+            s3meta = s3metas.pop(package_info['filename'], {})
+            if not s3meta:
+                logger.warn('File missing for {0}/{1}'.format(safe_name, package_info['filename']))
+            elif package_info.get('etag') != s3meta.get('ETag'):
+                logger.warn('ETag changed for {0}/{1} - {2} -> {3}'.format(
+                    safe_name, package_info['filename'], package_info.get('etag'), s3meta.get('ETag')))
+            else:
+                logger.info('Check OK for {0}/{1}'.format(safe_name, package_info['filename']))
+
+            if s3metas.pop(package_info['filename'] + '.asc', None) is None and package_info.get('has_sig'):
+                logger.warn('Signature missing for {0}/{1}'.format(safe_name, package_info['filename']))
+
+        for key in sorted(s3metas):
+            if not (key == '' or key.endswith('json')):
+                logger.warn('File not in manifest for {0}/{1}'.format(safe_name, key))
 
     def upload(self, package):
         """Upload a single package"""
-        safe_name = package.safe_name
-        version = package.metadata.version
-        project = self._get_project(safe_name)
+        self.upload_packages([package])
 
-        s3meta = self._put_package(safe_name, package)
-        project.add_package(package, etag=s3meta['ETag'])
+    def upload_packages(self, packages):
+        """Upload multiple packages, then publish the index for each affected project and release once.
 
-        self._put_signature(safe_name, package)
-        self._put_manifest(safe_name, project)
-        self._put_json(safe_name, project, version)
-        self._put_release(safe_name, project, version)
-        self._put_json(safe_name, project)
-        self._put_index(safe_name, project)
+        If any package or project fails, the others are still uploaded and published, and the first error is raised afterwards.
+        The manifest entry of each package is built before anything is uploaded, so that packages with invalid metadata are never uploaded.
+        """
+        error = None
+        valid = []
+        for package in packages:
+            try:
+                valid.append((package, self._get_project(package.safe_name).make_package_info(package)))
+            except Exception as e:
+                logger.error('Failed to read metadata from {0}'.format(package.basefilename), exc_info=True)
+                error = error or e
+
+        package_infos = defaultdict(list)
+        with futures.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            uploads = [(package, package_info, executor.submit(self._upload_package, package)) for package, package_info in valid]
+            for package, package_info, future in uploads:
+                try:
+                    s3meta = future.result()
+                except Exception as e:
+                    logger.error('Failed to upload {0}'.format(package.basefilename), exc_info=True)
+                    error = error or e
+                    continue
+
+                package_info['etag'] = s3meta['ETag']
+                package_infos[package.safe_name].append(package_info)
+
+        for safe_name, infos in package_infos.items():
+            try:
+                self._publish_packages(safe_name, infos)
+            except Exception as e:
+                logger.error('Failed to publish {0}'.format(safe_name), exc_info=True)
+                # The loaded project holds entries that were never written, so it must not be added to the catalog
+                self._project_cache.pop(safe_name, None)
+                error = error or e
+
+        if error is not None:
+            raise error
 
     def package_is_uploaded(self, package, bypass_cache=False):
         """Test to see if a given package has already been uploaded"""
         safe_name = package.safe_name
         project = self._get_project(safe_name, bypass_cache)
-
-        for package_info in project.get_manifest():
-            if package_info['filename'] == package.basefilename:
-                return True
-
-        return False
-
-    def update_index(self):
-        """Update the top-level project index"""
-        projects = self._list_project_names()
-        for safe_name in projects[:]:
-            if safe_name not in self._project_cache and not self._head_manifest(safe_name):
-                projects.remove(safe_name)
-        self._update_repository_index(projects)
+        return project.get_package_info(package.basefilename) is not None
+
+    def get_changed_packages(self, packages):
+        """Return the packages that are missing from the repository, or whose content differs from the stored file of the same name.
+
+        The manifests of all affected projects are loaded concurrently. If several packages have the same filename, only the first is considered.
+        """
+        self._wait([self._submit(self._get_project, safe_name) for safe_name in set(package.safe_name for package in packages)])
+
+        changed = []
+        seen = {}
+        for package in packages:
+            first = seen.setdefault(package.basefilename, package)
+            if first is not package:
+                if first.sha2_digest != package.sha2_digest:
+                    logger.warn('Skipping {0} because it differs from {1}, which has the same name'.format(package.filename, first.filename))
+                continue
+
+            package_info = self._get_project(package.safe_name).get_package_info(package.basefilename)
+            if package_info is None:
+                changed.append(package)
+            elif package_info['digests']['sha256'] != package.sha2_digest:
+                logger.info('{0} has changed'.format(package.basefilename))
+                changed.append(package)
+        return changed
+
+    def update_index(self, rebuild=False):
+        """Update the project catalog and top-level project index.
+
+        The existing catalog is updated with any projects that have been loaded or published, and reconciled
+        with a listing of the project prefixes, so that projects added or removed by other tools are picked up.
+        If the catalog is missing or unreadable, or rebuild is set, it is rebuilt by checking every project in the repository.
+        """
+        for attempt in range(CONFLICT_RETRIES):
+            project_names = self._list_project_names()
+            catalog = None if rebuild else self._get_catalog()
+            if catalog is None:
+                catalog = self._build_catalog(project_names)
+            else:
+                self._reconcile_catalog(catalog, project_names)
+            try:
+                self._update_catalog(catalog, conditional=True)
+                return
+            except ClientError as e:
+                if e.response['Error']['Code'] not in CONFLICT_CODES or attempt == CONFLICT_RETRIES - 1:
+                    raise e
+            logger.info('Project catalog was changed by another writer; merging and retrying')
+            _backoff(attempt)
+
+    def publish_to(self, destination):
+        """Copy the repository from local storage to another storage backend, such as the S3 bucket.
+
+        Objects are copied along with their recorded headers, and keys ending in a slash are restored from index.html files.
+        Package files are copied first, then manifests and project pages, and the repository indexes and catalog last, so that
+        clients are never shown links to objects that have not been copied yet. Objects with the same ETag and size in the
+        destination are skipped, unless the catalogs show that the pages were written with different headers. Objects in the
+        destination that do not exist locally are left in place.
+        """
+        source = self.storage.storage
+        if not isinstance(source, LocalStorage):
+            raise ValueError('Only repositories in local storage can be published')
+        destination = InstrumentedStorage(destination, self.stats)
+        catalog_key = '{0}projects.json'.format(self.prefix)
+        prefixes = [self.prefix] + ([self.simple_json_prefix] if self.simple_json_prefix else [])
+        indexes = prefixes + [catalog_key]
+
+        headers_changed = self._get_index_headers(source, catalog_key) != self._get_index_headers(destination, catalog_key)
+        if headers_changed:
+            logger.info('Page headers differ from those in the destination; copying all pages')
+
+        packages, pages = [], []
+        for prefix in prefixes:
+            existing = {}
+            for page in destination.list(prefix):
+                existing.update((item['Key'], item) for item in page.get('Contents', []))
+            for page in source.list(prefix):
+                for item in page.get('Contents', []):
+                    key = item['Key']
+                    is_page = prefix != self.prefix or key.endswith('/') or key.endswith('json')
+                    if key in indexes:
+                        continue
+                    elif _is_unchanged(item, existing.get(key), is_page and headers_changed):
+                        logger.debug('Skipping {0} because it is unchanged'.format(key))
+                        with self._counter_lock:
+                            self.objects_skipped += 1
+                    else:
+                        (pages if is_page else packages).append(key)
+
+        with futures.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            self._wait([executor.submit(self._copy_package, source, destination, key) for key in packages])
+        self._wait([self._submit(self._copy_page, source, destination, key) for key in pages])
+        # The catalog is copied last, as it records the headers of the pages that have been copied
+        for key in indexes:
+            self._copy_page(source, destination, key)
+
+    def get_content_type(self, key, metadata):
+        """Return the content type of an object, inferring it from the key if it was not recorded"""
+        if metadata.get('ContentType'):
+            return metadata['ContentType']
+        if self.simple_json_prefix and key.startswith(self.simple_json_prefix):
+            return SIMPLE_JSON_CONTENT_TYPE
+        if key.endswith('/'):
+            return 'text/html'
+        if key.endswith('json'):
+            return 'application/json'
+        return mimetypes.guess_type(key)[0] or 'application/octet-stream'
+
+    def _get_index_headers(self, storage, catalog_key):
+        """Return the headers that the catalog in a storage backend records for the repository index, or None if it does not record them"""
+        try:
+            return json.loads(storage.get(catalog_key)['Body'].read().decode('utf-8')).get('index_headers')
+        except ClientError as e:
+            if e.response['Error']['Code'] in ['403', '404', 'NoSuchKey']:
+                return None
+            raise e
+        except (AttributeError, ValueError):
+            return None
+
+    def _copy_package(self, source, destination, key):
+        logger.info('Uploading {0}'.format(key))
+        content_type = self.get_content_type(key, source.head(key))
+        destination.upload_file(source.get_filename(key), key, content_type)
+        with self._counter_lock:
+            self.objects_written += 1
+
+    def _copy_page(self, source, destination, key):
+        try:
+            response = source.get(key)
+        except ClientError as e:
+            if e.response['Error']['Code'] != '404':
+                raise e
+            return
+        body = response['Body'].read()
+        content_encoding = response.get('ContentEncoding')
+        if content_encoding is None and 'ContentType' not in response and body[:2] == GZIP_MAGIC:
+            # Objects stored before headers were recorded may be compressed pages; pages are never gzip files themselves
+            content_encoding = 'gzip'
+        logger.info('Uploading {0}'.format(key))
+        destination.put(key, body, self.get_content_type(key, response), content_encoding, response.get('CacheControl'))
+        with self._counter_lock:
+            self.objects_written += 1
 
     def _get_project(self, safe_name, bypass_cache=False):
         project = None
@@ -123,8 +397,9 @@ class Repository(object):
 
         if project is None:
             try:
-                manifest = self._get_manifest(safe_name)
-                project = Project(safe_name, self, manifest)
+                manifest, etag = self._get_manifest(safe_name)
+                with self.stats.timer('project.load'):
+                    project = Project(safe_name, self, manifest, etag)
             except ClientError as e:
                 if e.response['Error']['Code'] in ['403', '404']:
                     logger.debug('No existing manifest for {0}'.format(safe_name))
@@ -136,138 +411,519 @@ class Repository(object):
 
         return project
 
+    def _publish_packages(self, safe_name, package_infos):
+        """Add entries to a project's manifest using a conditional write, then publish the project.
+
+        If another writer changes the manifest after it was read, the write fails, and the entries are merged into
+        a fresh copy of the manifest before trying again. Once the indexes are published, the manifest is checked
+        again; if another writer has replaced it in the meantime, its indexes may have been overwritten by older
+        ones, so they are regenerated from the latest manifest, up to CONFLICT_RETRIES times.
+        """
+        versions = set(p['version'] for p in package_infos)
+        for attempt in range(CONFLICT_RETRIES):
+            project = self._get_project(safe_name, bypass_cache=attempt > 0)
+            with self.stats.timer('project.add_packages'):
+                project.add_package_infos(package_infos)
+            try:
+                self._put_manifest(safe_name, project, conditional=True)
+                break
+            except ClientError as e:
+                if e.response['Error']['Code'] not in CONFLICT_CODES or attempt == CONFLICT_RETRIES - 1:
+                    raise e
+            logger.info('Manifest for {0} was changed by another writer; merging and retrying'.format(safe_name))
+            _backoff(attempt)
+
+        self._published.add(safe_name)
+        for attempt in range(CONFLICT_RETRIES):
+            self._publish_indexes(safe_name, project, versions)
+            etag = self._head_manifest(safe_name).get('ETag')
+            if etag == project.etag:
+                return
+            if etag is None:
+                raise ValueError('Manifest for {0} was deleted while publishing'.format(safe_name))
+            if attempt == CONFLICT_RETRIES - 1:
+                # The writer that keeps replacing the manifest checks it again after publishing its own indexes
+                logger.warn('Manifest for {0} is still changing; leaving its indexes to the other writer'.format(safe_name))
+                return
+            logger.info('Manifest for {0} was replaced by another writer; regenerating indexes'.format(safe_name))
+            _backoff(attempt)
+            project = self._get_project(safe_name, bypass_cache=True)
+
+    def _publish_project(self, safe_name, versions):
+        """Upload the manifest and regenerate the project index, plus the release index for each listed version"""
+        project = self._get_project(safe_name)
+        self._put_manifest(safe_name, project)
+        if self.simple_json_prefix and canonicalize_name(safe_name) != safe_name:
+            # Earlier versions stored the JSON simple API page under the name of the project prefix
+            self.storage.delete('{0}{1}/'.format(self.simple_json_prefix, safe_name))
+        self._publish_indexes(safe_name, project, versions)
+        if not self.recent_versions:
+            # History pages may remain from an earlier index that was limited to recent versions
+            self._delete_history_pages(safe_name, 0)
+
+    def _publish_indexes(self, safe_name, project, versions):
+        """Regenerate the project index, plus the release index for each listed version.
+
+        If the project index is limited to recent versions, the history pages that may have changed are regenerated as well.
+        """
+        recent = project.get_recent_versions(self.recent_versions) if self.recent_versions else None
+        requests = []
+        for version in sorted(versions):
+            requests.append(self._submit(self._put_json, safe_name, project, version, recent))
+            requests.append(self._submit(self._put_release, safe_name, project, version))
+        requests.append(self._submit(self._put_json, safe_name, project, None, recent))
+        requests.append(self._submit(self._put_index, safe_name, project, recent))
+        if self.simple_json_prefix:
+            requests.append(self._submit(self._put_simple_json, safe_name, project, recent))
+
+        if self.recent_versions and versions:
+            # Adding or removing a version shifts every later version to a different position, so all pages from the first
+            # changed one onward must be regenerated. New versions are usually the latest, so this is normally only the last page.
+            first_page = min(project.get_page_number(self.page_size, version) for version in versions)
+            for page in range(first_page, project.get_page_count(self.page_size)):
+                requests.append(self._submit(self._put_history_page, safe_name, project, page))
+        self._wait(requests)
+
+        if self.recent_versions:
+            # Pages beyond the end of the history remain if versions were removed or the page size was changed
+            self._delete_history_pages(safe_name, project.get_page_count(self.page_size))
+
+    def _delete_history_pages(self, safe_name, first_page):
+        """Delete the pages of a project's version history numbered first_page or above"""
+        pages_prefix = '{0}{1}/page/'.format(self.prefix, safe_name)
+        keys = []
+        for listing in self.storage.list(pages_prefix, '/'):
+            for common_prefix in listing.get('CommonPrefixes', []):
+                page = common_prefix['Prefix'][len(pages_prefix):-1]
+                if page.isdigit() and int(page) >= first_page:
+                    keys += [common_prefix['Prefix'], common_prefix['Prefix'] + 'json']
+
+        for key in keys:
+            logger.info('Deleting {0}'.format(key))
+            self._etags.pop(key, None)
+        self._wait([self._submit(self.storage.delete, key) for key in keys])
+
+    def _build_catalog(self, projects):
+        """Build catalog entries for the listed projects, checking for a manifest for each project that is not loaded"""
+        requests = []
+        for safe_name in projects:
+            project = self._project_cache.get(safe_name)
+            if project is None or project.etag is None:
+                requests.append((safe_name, self._submit(self._head_manifest, safe_name)))
+        self._wait([request for _, request in requests])
+
+        catalog = {}
+        for safe_name, request in requests:
+            s3meta = request.result()
+            if s3meta:
+                catalog[safe_name] = {'etag': s3meta['ETag'], 'version': None}
+        return catalog
+
+    def _reconcile_catalog(self, catalog, project_names):
+        """Remove catalog entries for projects that no longer exist, and check the prefixes that are not in the catalog for a manifest"""
+        for safe_name in set(catalog).difference(project_names):
+            logger.info('Removing {0} from the project catalog'.format(safe_name))
+            del catalog[safe_name]
+        catalog.update(self._build_catalog([safe_name for safe_name in project_names if safe_name not in catalog]))
+
+    def _update_catalog(self, catalog, conditional=False):
+        """Merge loaded projects into the catalog, then upload it along with the repository index.
+
+        Each entry records the headers that all of the project's pages were written with, if they are known to be the same.
+        If conditional is set, the catalog is only written if it has not been changed by another writer since it was read.
+        """
+        for safe_name, project in self._project_cache.items():
+            if project.etag is None:
+                continue
+            elif project.releases:
+                entry = {'etag': project.etag, 'version': str(project.latest_version)}
+                page_headers = self._get_page_headers() if safe_name in self._reindexed else catalog.get(safe_name, {}).get('page_headers')
+                # Publishing new packages only rewrites some of the pages, so the others may still have different headers
+                if page_headers is not None and not (safe_name in self._published and page_headers != self._get_page_headers()):
+                    entry['page_headers'] = page_headers
+                catalog[safe_name] = entry
+            else:
+                catalog.pop(safe_name, None)
+
+        index_etag = self._update_repository_index(sorted(catalog))['ETag']
+        simple_json_etag = self._update_repository_simple_json(sorted(catalog))['ETag'] if self.simple_json_prefix else None
+        self._put_catalog(catalog, index_etag, simple_json_etag, conditional)
+
+    def _get_catalog(self):
+        """Download and load the project catalog, returning None if it is missing or invalid"""
+        catalog_key = '{0}projects.json'.format(self.prefix)
+        # The repository indexes may have been written with other headers, so their ETags are only trusted if the catalog records their headers
+        self._etags.pop(self.prefix, None)
+        if self.simple_json_prefix:
+            self._etags.pop(self.simple_json_prefix, None)
+        logger.info('Downloading {0}'.format(catalog_key))
+        try:
+            response = self.storage.get(catalog_key)
+            self._etags[catalog_key] = response['ETag']
+            catalog = json.loads(response['Body'].read().decode('utf-8'))
+        except ClientError as e:
+            if e.response['Error']['Code'] in ['403', '404']:
+                logger.info('No project catalog found; rebuilding')
+                self._etags.pop(catalog_key, None)
+                return None
+            raise e
+        except ValueError:
+            logger.warn('Invalid project catalog; rebuilding', exc_info=True)
+            return None
+
+        if catalog.get('format') != CATALOG_FORMAT:
+            logger.info('Unsupported project catalog format; rebuilding')
+            return None
+        if catalog.get('index_headers') == self._get_page_headers():
+            if catalog.get('index_etag'):
+                self._etags[self.prefix] = catalog['index_etag']
+            if self.simple_json_prefix and catalog.get('simple_json_etag') and catalog.get('simple_json_prefix') == self.simple_json_prefix:
+                self._etags[self.simple_json_prefix] = catalog['simple_json_etag']
+        return catalog['projects']
+
+    def _put_catalog(self, catalog, index_etag, simple_json_etag=None, conditional=False):
+        """Dump and upload the project catalog, along with the ETags and headers of the repository indexes that list its projects"""
+        catalog_key = '{0}projects.json'.format(self.prefix)
+        chunks = json.JSONEncoder(sort_keys=True).iterencode({
+            'format': CATALOG_FORMAT, 'index_etag': index_etag, 'index_headers': self._get_page_headers(),
+            'simple_json_etag': simple_json_etag, 'simple_json_prefix': self.simple_json_prefix, 'projects': catalog})
+        with self._spool(chunks, 'serialize.catalog') as (body, etag):
+            return self._put_spooled(catalog_key, body, etag, 'application/json; charset=utf-8',
+                                     **_preconditions(self._etags.get(catalog_key), conditional))
+
     def _head_manifest(self, safe_name):
         """See if a manifest exists for this project"""
         json_key = '{0}{1}/manifest.json'.format(self.prefix, safe_name)
         logger.info('Checking {0}'.format(json_key))
         try:
-            return self.client.head_object(Bucket=self.bucket, Key=json_key)
+            return self.storage.head(json_key)
         except ClientError as e:
             if e.response['Error']['Code'] in ['403', '404']:
                 return {}
             else:
                 raise e
 
-    def _head_package(self, safe_name, filename):
-        """Upload a single package to S3"""
-        package_key = '{0}{1}/{2}'.format(self.prefix, safe_name, filename)
-        logger.info('Checking {0}'.format(package_key))
+    def _get_manifest(self, safe_name):
+        """Download and load the project manifest, in any format, returning it along with its ETag"""
+        json_key = '{0}{1}/manifest.json'.format(self.prefix, safe_name)
+        cache_key = '{0}/{1}'.format(self.bucket, json_key)
+        metadata, body = self.cache.get(cache_key) if self.cache else (None, None)
         try:
-            return self.client.head_object(Bucket=self.bucket, Key=package_key)
+            logger.info('Downloading {0}'.format(json_key))
+            response = self.storage.get(json_key, if_none_match=metadata['ETag'] if metadata else None)
+            metadata, body = {'ETag': response['ETag'], 'ContentEncoding': response.get('ContentEncoding')}, response['Body'].read()
+            if self.cache:
+                self.cache.put(cache_key, metadata, body)
         except ClientError as e:
-            if e.response['Error']['Code'] in ['403', '404']:
-                return {}
-            else:
+            if not (metadata and e.response['Error']['Code'] in ['304', 'NotModified']):
                 raise e
+            logger.info('Using cached {0}'.format(json_key))
 
-    def _get_manifest(self, safe_name):
-        """Download and load the project manifest JSON"""
-        json_key = '{0}{1}/manifest.json'.format(self.prefix, safe_name)
-        logger.info('Downloading {0}'.format(json_key))
-        with io.BytesIO() as data:
-            self.client.download_fileobj(Fileobj=data, Bucket=self.bucket, Key=json_key)
-            data.seek(0, 0)
-            return json.load(io.TextIOWrapper(data, encoding='utf-8'))
-
-    def _put_manifest(self, safe_name, project):
-        """Dump and upload the project manifest JSON"""
+        self._etags[json_key] = metadata['ETag']
+        with self.stats.timer('parse.manifest') as timing:
+            timing.size = len(body)
+            return decode_manifest(body, metadata.get('ContentEncoding')), metadata['ETag']
+
+    def _put_manifest(self, safe_name, project, conditional=False):
+        """Dump and upload the project manifest JSON, in the configured format.
+
+        If conditional is set, the manifest is only written if it has not been changed by another writer since the project was loaded.
+        """
         json_key = '{0}{1}/manifest.json'.format(self.prefix, safe_name)
-        logger.info('Uploading {0}'.format(json_key))
-        with io.BytesIO() as data:
-            json.dump(project.get_manifest(), codecs.getwriter('utf-8')(data))
-            data.seek(0, 0)
-            return self.client.put_object(Body=data, Bucket=self.bucket, Key=json_key, ContentType='application/json; charset=utf-8')
-
-    def _put_json(self, safe_name, project, version=None):
-        """Regenerate and upload the project or release-level index JSON"""
+        chunks = encode_manifest(project.get_manifest(), self.manifest_format.replace('-gzip', ''))
+        content_encoding = 'gzip' if self.manifest_format.endswith('-gzip') else None
+        with self._spool(chunks, 'serialize.manifest', content_encoding) as (body, etag):
+            response = self._put_spooled(json_key, body, etag, 'application/json; charset=utf-8', content_encoding,
+                                         **_preconditions(project.etag, conditional))
+            project.etag = response['ETag']
+            if self.cache:
+                body.seek(0)
+                self.cache.put('{0}/{1}'.format(self.bucket, json_key), {'ETag': response['ETag'], 'ContentEncoding': content_encoding}, body)
+        return response
+
+    def _put_json(self, safe_name, project, version=None, versions=None):
+        """Regenerate and upload the project or release-level index JSON, optionally listing releases for only the given versions"""
         version_prefix = '' if version is None else '/{0}'.format(version)
         json_key = '{0}{1}{2}/json'.format(self.prefix, safe_name, version_prefix)
-        logger.info('Uploading {0}'.format(json_key))
-        with io.BytesIO() as data:
-            json.dump(project.get_metadata(version), codecs.getwriter('utf-8')(data))
-            data.seek(0, 0)
-            return self.client.put_object(Body=data, Bucket=self.bucket, Key=json_key, ContentType='application/json; charset=utf-8')
-
-    def _put_index(self, safe_name, project):
-        """Regenerate and upload the project-level index HTML"""
+        return self._put_page(json_key, project.iter_metadata_json(version, versions), 'application/json; charset=utf-8', 'render.json')
+
+    def _put_index(self, safe_name, project, versions=None):
+        """Regenerate and upload the project-level index HTML, optionally listing only the given versions"""
         index_key = '{0}{1}/'.format(self.prefix, safe_name)
-        logger.info('Uploading {0}'.format(index_key))
-        template = environ.get_template('index.html.j2')
-        with io.BytesIO() as data:
-            data.write(template.render(project=project).encode())
-            data.seek(0, 0)
-            return self.client.put_object(Body=data, Bucket=self.bucket, Key=index_key, ContentType='text/html; charset=utf-8')
+        template = get_template('index.html.j2')
+        history = self._get_history_links(project, 'page/') if versions is not None else None
+        return self._put_page(index_key, template.generate(project=project, versions=versions, history=history), 'text/html; charset=utf-8',
+                              'render.index')
+
+    def _put_history_page(self, safe_name, project, page):
+        """Regenerate and upload the index HTML and JSON for a page of the project's version history"""
+        versions = project.get_page_versions(self.page_size, page)
+        page_key = '{0}{1}/page/{2}/'.format(self.prefix, safe_name, page)
+        template = get_template('index.html.j2')
+        history = self._get_history_links(project, '../')
+        self._put_page(page_key, template.generate(project=project, versions=versions, history=history), 'text/html; charset=utf-8', 'render.index')
+        return self._put_page(page_key + 'json', project.iter_metadata_json(None, versions), 'application/json; charset=utf-8', 'render.json')
+
+    def _get_history_links(self, project, base):
+        """Return (href, first version, last version) for each page of the version history, relative to base"""
+        links = []
+        for page in range(project.get_page_count(self.page_size)):
+            versions = project.get_page_versions(self.page_size, page)
+            links.append(('{0}{1}/'.format(base, page), versions[0], versions[-1]))
+        return links
 
     def _put_release(self, safe_name, project, version):
         """Regenerate and upload the release-level index HTML"""
         release_key = '{0}{1}/{2}/'.format(self.prefix, safe_name, version)
-        logger.info('Uploading {0}'.format(release_key))
-        template = environ.get_template('release.html.j2')
-        with io.BytesIO() as data:
-            data.write(template.render(project=project, version=version).encode())
-            data.seek(0, 0)
-            return self.client.put_object(Body=data, Bucket=self.bucket, Key=release_key, ContentType='text/html; charset=utf-8')
+        template = get_template('release.html.j2')
+        return self._put_page(release_key, template.generate(project=project, version=version), 'text/html; charset=utf-8', 'render.release')
+
+    def _put_simple_json(self, safe_name, project, versions=None):
+        """Regenerate and upload the project-level PEP 691 JSON simple API page, optionally listing only the given versions"""
+        # Clients request the page for the normalized project name, which may differ from the name of the project prefix
+        simple_key = '{0}{1}/'.format(self.simple_json_prefix, canonicalize_name(safe_name))
+        chunks = json.JSONEncoder().iterencode(project.get_simple_index(versions))
+        return self._put_page(simple_key, chunks, SIMPLE_JSON_CONTENT_TYPE, 'render.simple_json')
+
+    def _update_repository_simple_json(self, projects):
+        """Regenerate and upload the repository-level PEP 691 JSON simple API page"""
+        names = sorted(set(canonicalize_name(safe_name) for safe_name in projects))
+        index = {'meta': {'api-version': SIMPLE_API_VERSION}, 'projects': [{'name': name} for name in names]}
+        chunks = json.JSONEncoder(sort_keys=True).iterencode(index)
+        return self._put_page(self.simple_json_prefix, chunks, SIMPLE_JSON_CONTENT_TYPE, 'render.simple_json')
 
     def _list_project_names(self):
         projects = []
         logger.info('Looking for projects in {}'.format(self.prefix))
-        for page in self.client.get_paginator('list_objects').paginate(Bucket=self.bucket, Prefix=self.prefix, Delimiter='/'):
+        for page in self.storage.list(self.prefix, '/'):
             projects += [p['Prefix'][len(self.prefix):-1] for p in page.get('CommonPrefixes', [])]
+            self._etags.update((item['Key'], item['ETag']) for item in page.get('Contents', []))
         return projects
 
+    def _list_simple_json_pages(self):
+        """Record the ETags of the JSON simple API pages, so that unchanged pages are not uploaded again"""
+        logger.info('Looking for JSON simple API pages in {}'.format(self.simple_json_prefix))
+        for page in self.storage.list(self.simple_json_prefix):
+            self._etags.update((item['Key'], item['ETag']) for item in page.get('Contents', []))
+
     def _update_repository_index(self, projects):
         """Regenerate and upload the repository-level index HTML"""
-        logger.info('Uploading {0}'.format(self.prefix))
-        template = environ.get_template('repository_index.html.j2')
-        with io.BytesIO() as data:
-            data.write(template.render(repository=self, projects=projects).encode())
-            data.seek(0, 0)
-            return self.client.put_object(Body=data, Bucket=self.bucket, Key=self.prefix, ContentType='text/html; charset=utf-8')
+        template = get_template('repository_index.html.j2')
+        chunks = template.generate(repository=self, projects=projects)
+        return self._put_page(self.prefix, chunks, 'text/html; charset=utf-8', 'render.repository_index')
+
+    def _submit(self, fn, *args, **kwargs):
+        """Run an S3 request on the shared request pool, returning a future for its result"""
+        return self._request_executor.submit(fn, *args, **kwargs)
+
+    def _wait(self, requests):
+        """Wait for all submitted requests to complete, then raise the first error encountered, if any"""
+        futures.wait(requests)
+        for request in requests:
+            request.result()
+
+    @contextmanager
+    def _spool(self, chunks, operation, content_encoding=None):
+        """Encode generated text to a temporary file as it is produced, yielding the file along with its MD5 ETag.
+
+        If a content encoding is given, the content is compressed using it.
+        """
+        md5 = hashlib.md5()
+        compressor = make_compressor(content_encoding) if content_encoding else None
+        with SpooledTemporaryFile(max_size=SPOOL_SIZE) as body:
+            with self.stats.timer(operation) as timing:
+                for data in _encode_chunks(chunks):
+                    data = compressor.compress(data) if compressor else data
+                    md5.update(data)
+                    body.write(data)
+                if compressor:
+                    data = compressor.flush()
+                    md5.update(data)
+                    body.write(data)
+                timing.size = body.tell()
+            body.seek(0)
+            yield body, '"{0}"'.format(md5.hexdigest())
+
+    def _put_object(self, key, chunks, content_type, operation, content_encoding=None, cache_control=None):
+        """Generate and upload an object from chunks of text, unless an object with identical content is already known to exist at the key"""
+        with self._spool(chunks, operation, content_encoding) as (body, etag):
+            return self._put_spooled(key, body, etag, content_type, content_encoding, cache_control)
+
+    def _get_page_headers(self):
+        """Return the headers that index pages are written with, which are recorded in the catalog"""
+        return {'CacheControl': self.cache_control, 'ContentEncoding': self.content_encoding}
+
+    def _forget_page_etags(self, safe_name):
+        """Forget the known ETags of a project's pages, so that they are uploaded again even if their content is unchanged"""
+        prefix = '{0}{1}/'.format(self.prefix, safe_name)
+        manifest_key = prefix + 'manifest.json'
+        for key in list(self._etags):
+            if key.startswith(prefix) and key != manifest_key:
+                self._etags.pop(key, None)
+        if self.simple_json_prefix:
+            self._etags.pop('{0}{1}/'.format(self.simple_json_prefix, canonicalize_name(safe_name)), None)
+
+    def _put_page(self, key, chunks, content_type, operation):
+        """Generate and upload an index page served to clients, using the configured content encoding and Cache-Control header"""
+        return self._put_object(key, chunks, content_type, operation, self.content_encoding, self.cache_control)
+
+    def _put_spooled(self, key, body, etag, content_type, content_encoding=None, cache_control=None, if_match=None, if_none_match=None):
+        """Upload a spooled object, unless an object with identical content is already known to exist at the key"""
+        if self._etags.get(key) == etag:
+            logger.info('Skipping {0} because it is unchanged'.format(key))
+            with self._counter_lock:
+                self.objects_skipped += 1
+            return {'ETag': etag}
+
+        logger.info('Uploading {0}'.format(key))
+        response = self.storage.put(key, body, content_type, content_encoding, cache_control, if_match, if_none_match)
+        self._etags[key] = response['ETag']
+        with self._counter_lock:
+            self.objects_written += 1
+        return response
+
+    def _upload_package(self, package):
+        """Upload a single package and its signature, returning the package object metadata"""
+        s3meta = self._put_package(package.safe_name, package)
+        self._put_signature(package.safe_name, package)
+        return s3meta
 
     def _put_package(self, safe_name, package):
         """Upload a single package to S3"""
         package_key = '{0}{1}/{2}'.format(self.prefix, safe_name, package.basefilename)
         logger.info('Uploading {0}'.format(package_key))
-        with open(package.filename, 'rb') as data:
-            return self.client.put_object(Body=data, Bucket=self.bucket, Key=package_key, ContentType='application/octet-stream')
+        return self.storage.upload_file(package.filename, package_key, 'application/octet-stream')
 
     def _put_signature(self, safe_name, package):
         if package.gpg_signature is None:
             return
         signed_key = '{0}{1}/{2}'.format(self.prefix, safe_name, package.signed_basefilename)
         logger.info('Uploading {0}'.format(signed_key))
-        with open(package.signed_filename, 'rb') as data:
-            return self.client.put_object(Body=data, Bucket=self.bucket, Key=signed_key, ContentType='application/octet-stream')
+        return self.storage.upload_file(package.signed_filename, signed_key, 'application/octet-stream')
 
-    def _get_packages(self, safe_name):
-        """Yield (PackageFile, metadata) for each package in the project"""
+    def _list_packages(self, safe_name):
+        """Return the S3 metadata for each object stored directly under the project prefix.
+
+        The ETags of all objects within the project, including release indexes, are recorded as well.
+        """
         prefix = '{0}{1}/'.format(self.prefix, safe_name)
         logger.info('Looking for packages in {}'.format(prefix))
+        items = []
+        for page in self.storage.list(prefix):
+            for item in page.get('Contents', []):
+                self._etags[item['Key']] = item['ETag']
+                if '/' not in item['Key'][len(prefix):]:
+                    items.append(item)
+        return items
+
+    def _get_range(self, key, start, end):
+        """Download an inclusive byte range of an object"""
+        with self.download_slots:
+            logger.debug('Downloading {0} bytes {1}-{2}'.format(key, start, end))
+            return self.storage.get(key, byte_range=(start, end))['Body'].read()
+
+    def _get_remote_package(self, safe_name, item, package_info, has_sig):
+        """Build a package from its existing manifest entry, refreshing wheel metadata using ranged reads.
+
+        Returns None if the metadata cannot be read, in which case the package must be downloaded in full.
+        """
+        if not package_info['filename'].endswith('.whl'):
+            return RemotePackage(safe_name, package_info, metadata_from_info(package_info), has_sig)
+
+        logger.info('Reading metadata from {0}'.format(item['Key']))
+        try:
+            with self.stats.timer('parse.wheel_metadata'):
+                data = read_wheel_metadata(partial(self._get_range, item['Key']), item['Size'])
+            return RemotePackage(safe_name, package_info, parse_metadata(data), has_sig)
+        except (ClientError, ValueError) as e:
+            logger.warn('Failed to read metadata from {0}: {1}'.format(item['Key'], e))
+
+    def _get_packages(self, safe_name, known_packages=None, journaled=None):
+        """Yield (PackageFile, metadata) for each package in the project.
+
+        Packages with an entry in known_packages whose ETag and digests are unchanged are not downloaded;
+        they are yielded as a RemotePackage built from the existing entry instead. Packages with an entry in
+        journaled whose ETag is unchanged were read by an earlier run of the same reindex, and are not read at all.
+        """
+        known_packages = known_packages or {}
+        journaled = journaled or {}
+        prefix = '{0}{1}/'.format(self.prefix, safe_name)
+        items = self._list_packages(safe_name)
+        keys = set(item['Key'] for item in items)
         with tempfile.TemporaryDirectory() as temp_dir:
-            for page in self.client.get_paginator('list_objects').paginate(Bucket=self.bucket, Prefix=prefix, Delimiter='/'):
-                for item in page.get('Contents', []):
-                    key = item['Key'].replace(prefix, '', 1)
-                    if not (key == '' or key.endswith('json') or key.endswith('.asc')):
-                        try:
-                            filename = os.path.join(temp_dir, key)
-                            logger.info('Downloading {0}'.format(item['Key']))
-                            self.client.download_file(Bucket=self.bucket, Key=item['Key'], Filename=filename)
-                            package = PackageFile.from_filename(filename, '')
-                            try:
-                                self.client.head_object(Bucket=self.bucket, Key=item['Key'] + '.asc')
-                                logger.info('Downloading {0}'.format(item['Key'] + '.asc'))
-                                self.client.download_file(Bucket=self.bucket, Key=item['Key'] + '.asc', Filename=filename + '.asc')
-                                package.add_gpg_signature(package.signed_filename, package.signed_basefilename)
-                            except ClientError as e:
-                                if e.response['Error']['Code'] in ['403', '404']:
-                                    logger.debug('No GPG signature for {0}'.format(item['Key']))
-                                else:
-                                    raise e
-                            yield (package, item)
-                        except InvalidDistribution as e:
-                            logger.warn('Skipping {0}: {1}'.format(item['Key'], e))
-                        except ClientError:
-                            logger.error('Failed to download {0}'.format(item['Key']), exc_info=True)
-                        finally:
-                            if os.path.exists(filename):
-                                os.unlink(filename)
+            for item in items:
+                key = item['Key'].replace(prefix, '', 1)
+                if key == '' or key.endswith('json') or key.endswith('.asc'):
+                    continue
+
+                has_sig = item['Key'] + '.asc' in keys
+                package_info = journaled.get(key)
+                if package_info and package_info.get('etag') == item['ETag']:
+                    yield (RemotePackage(safe_name, package_info, metadata_from_info(package_info), has_sig), item)
+                    continue
+
+                package_info = known_packages.get(key)
+                if package_info and package_info.get('etag') == item['ETag'] and \
+                        package_info.get('digests', {}).get('md5') and package_info.get('digests', {}).get('sha256'):
+                    package = self._get_remote_package(safe_name, item, package_info, has_sig)
+                    if package is not None:
+                        yield (package, item)
+                        continue
+
+                filename = os.path.join(temp_dir, key)
+                try:
+                    with self.download_slots:
+                        logger.info('Downloading {0}'.format(item['Key']))
+                        self.storage.download_file(item['Key'], filename)
+                    with self.stats.timer('parse.package'):
+                        package = PackageFile.from_filename(filename, '')
+                    if has_sig:
+                        logger.info('Downloading {0}'.format(item['Key'] + '.asc'))
+                        self.storage.download_file(item['Key'] + '.asc', filename + '.asc')
+                        package.add_gpg_signature(package.signed_filename, package.signed_basefilename)
+                    else:
+                        logger.debug('No GPG signature for {0}'.format(item['Key']))
+                    yield (package, item)
+                except InvalidDistribution as e:
+                    logger.warn('Skipping {0}: {1}'.format(item['Key'], e))
+                except ClientError:
+                    logger.error('Failed to download {0}'.format(item['Key']), exc_info=True)
+                finally:
+                    for path in [filename, filename + '.asc']:
+                        if os.path.exists(path):
+                            os.unlink(path)
+
+
+def _is_unchanged(item, existing, headers_changed):
+    """Test whether a listed object matches the listing of the existing object it would replace"""
+    if existing is None or headers_changed or existing['Size'] != item['Size']:
+        return False
+    # Objects uploaded in multiple parts do not have an MD5 ETag, so package files that are the same size are assumed to be unchanged
+    return existing['ETag'] == item['ETag'] or '-' in existing['ETag'].strip('"')
+
+
+def _preconditions(etag, conditional):
+    """Return the put arguments that make a write fail if the object no longer has the given ETag, or now exists if it had none"""
+    if not conditional:
+        return {}
+    return {'if_match': etag} if etag else {'if_none_match': '*'}
+
+
+def _backoff(attempt):
+    """Wait a random, exponentially increasing time before retrying a conflicting write, so that writers do not retry in lockstep"""
+    time.sleep(random.uniform(0, RETRY_DELAY * 2 ** attempt))
+
+
+def _encode_chunks(chunks):
+    """Join the small chunks of text produced by template rendering and JSON encoding into larger encoded blocks"""
+    buffer = []
+    buffered = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= CHUNK_SIZE:
+            yield ''.join(buffer).encode('utf-8')
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
@@ -0,0 +1,213 @@
+import io
+import logging
+import os
+import shutil
+import threading
+from concurrent import futures
+from contextlib import closing
+from timeit import default_timer
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import unquote, urlsplit
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+    from urlparse import urlsplit
+
+from botocore.exceptions import ClientError
+
+from . import util
+from .compression import GZIP_MAGIC, decompress
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+class CachingProxy(object):
+    """Read-through cache of repository objects, stored in the repository's disk cache.
+
+    Cached objects are served without a request for revalidate_after seconds after they were fetched or last
+    revalidated, and are then revalidated using a conditional request on their ETag. Concurrent requests for
+    the same object share a single fetch. Bodies are streamed from storage to the cache, and from the cache to clients;
+    objects larger than the whole cache are not cached, and are streamed from storage to clients instead.
+    """
+    def __init__(self, repository, revalidate_after=60):
+        self.repository = repository
+        self.revalidate_after = revalidate_after
+        self._validated = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def open(self, key):
+        """Return (metadata, body, size) for an object, with the body as a file-like object that the caller must close.
+
+        Raises a ClientError if the object cannot be fetched. If it is not cached, such as when it is larger than
+        the cache, it is streamed directly from storage instead.
+        """
+        _, response = self._get(key)
+        if response is None:
+            cache_key = '{0}/{1}'.format(self.repository.bucket, key)
+            cached_metadata, body = self.repository.cache.open(cache_key)
+            if body is not None:
+                return cached_metadata, body, os.fstat(body.fileno()).st_size - body.tell()
+
+            logger.debug('Streaming uncached {0}'.format(key))
+            response = self.repository.storage.get(key)
+        return _get_metadata(response), response['Body'], response['ContentLength']
+
+    def _get(self, key):
+        """Return (metadata, response) for an object once it is cached and validated.
+
+        If the object is too large to cache, the response is also returned to the caller that fetched it, so that its body can be
+        streamed without another request; it is None for cached objects, and for callers that shared another caller's fetch.
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is None:
+                future = self._in_flight[key] = futures.Future()
+            else:
+                return future.result(), None
+
+        try:
+            metadata, response = self._fetch(key)
+            future.set_result(metadata)
+            return metadata, response
+        except Exception as e:
+            future.set_exception(e)
+            raise e
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def _fetch(self, key):
+        cache = self.repository.cache
+        cache_key = '{0}/{1}'.format(self.repository.bucket, key)
+        metadata, body = cache.open(cache_key)
+        if body is not None:
+            body.close()
+        validated = self._validated.get(key)
+        if metadata and validated is not None and default_timer() - validated < self.revalidate_after:
+            return metadata, None
+
+        try:
+            logger.debug('Downloading {0}'.format(key))
+            response = self.repository.storage.get(key, if_none_match=metadata['ETag'] if metadata else None)
+            metadata = _get_metadata(response)
+            if response['ContentLength'] > cache.max_size:
+                # Caching the object would evict everything else, and it would then be evicted itself
+                logger.debug('Not caching {0}, which is larger than the cache'.format(key))
+                cache.delete(cache_key)
+                self._validated.pop(key, None)
+                return metadata, response
+            with closing(response['Body']) as body:
+                cache.put(cache_key, metadata, body)
+        except ClientError as e:
+            if not (metadata and e.response['Error']['Code'] in ['304', 'NotModified']):
+                raise e
+            logger.debug('Using cached {0}'.format(key))
+
+        self._validated[key] = default_timer()
+        return metadata, None
+
+
+class ProxyServer(ThreadingMixIn, HTTPServer):
+    """HTTP server that handles each request in its own thread, serving repository objects through a CachingProxy.
+
+    If rewrite_urls is set, links to the repository in index pages are rewritten to point at this server, so that
+    packages are downloaded through the cache as well.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, proxy, rewrite_urls=True):
+        HTTPServer.__init__(self, address, _RequestHandler)
+        self.proxy = proxy
+        self.rewrite_urls = rewrite_urls
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    server_version = '{0}/{1}'.format(util.pkgname, util.version)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def log_message(self, format, *args):
+        logger.info('{0} - {1}'.format(self.address_string(), format % args))
+
+    def _serve(self, send_body):
+        proxy = self.server.proxy
+        key = self._get_key()
+        if key is None:
+            return self.send_error(404)
+
+        with proxy.repository.stats.timer('serve.request') as timing:
+            try:
+                metadata, body, size = proxy.open(key)
+            except ClientError as e:
+                code = e.response['Error']['Code']
+                return self.send_error(404 if code in ['403', '404', 'NoSuchKey'] else 502)
+
+            with closing(body):
+                etag = metadata['ETag']
+                content_type = proxy.repository.get_content_type(key, metadata)
+                content_encoding = metadata.get('ContentEncoding')
+                is_page = content_type.startswith('text/html') or 'json' in content_type
+                if is_page and (content_encoding is None or self.server.rewrite_urls):
+                    # Only pages are read into memory; artifacts are streamed
+                    body = io.BytesIO(body.read())
+                if is_page and content_encoding is None and body.getvalue()[:2] == GZIP_MAGIC:
+                    # Local storage does not record content encodings, but unlike artifacts, pages are never gzip files themselves
+                    content_encoding = 'gzip'
+                if is_page and self.server.rewrite_urls:
+                    repository_url = proxy.repository.get_url()
+                    server_url = 'http://{0}/{1}'.format(self.headers.get('Host') or '{0}:{1}'.format(*self.server.server_address[:2]),
+                                                         proxy.repository.prefix)
+                    data = decompress(body.getvalue(), content_encoding).replace(repository_url.encode('utf-8'), server_url.encode('utf-8'))
+                    body, size = io.BytesIO(data), len(data)
+                    content_encoding = None
+                    etag = 'W/' + etag
+
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(size))
+                self.send_header('ETag', etag)
+                if content_encoding:
+                    self.send_header('Content-Encoding', content_encoding)
+                self.end_headers()
+                if send_body:
+                    shutil.copyfileobj(body, self.wfile, COPY_BUFFER_SIZE)
+                    timing.size = size
+
+    def _get_key(self):
+        """Return the object key for the request path, or None if it is outside the repository"""
+        key = unquote(urlsplit(self.path).path).lstrip('/')
+        parts = key.split('/')
+        if '..' in parts or '.' in parts:
+            return None
+
+        repository = self.server.proxy.repository
+        prefixes = [repository.prefix] + ([repository.simple_json_prefix] if repository.simple_json_prefix else [])
+        if not any(key.startswith(prefix) for prefix in prefixes):
+            return None
+        return key
+
+
+def _get_metadata(response):
+    """Return the parts of a GET response that are cached and served along with the body"""
+    return {
+        'ETag': response['ETag'],
+        'ContentType': response.get('ContentType'),
+        'ContentEncoding': response.get('ContentEncoding'),
+        }
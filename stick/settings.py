@@ -1,8 +1,13 @@
-from .repository import Repository
+import os
+
+from . import j2
+from .cache import DiskCache
 
 
 class Settings(object):
-    def __init__(self, bucket, baseurl, prefix, profile=None, skip_existing=True, sign=False, sign_with='gpg', identity=None):
+    def __init__(self, bucket, baseurl, prefix, profile=None, skip_existing=True, sign=False, sign_with='gpg', identity=None, jobs=1, downloads=None,
+                 cache_dir=None, cache_size=512, max_requests=10, local_dir=None, manifest_format='legacy', simple_json_prefix=None,
+                 compress='none', cache_control=None, recent_versions=None, page_size=100, processes=None):
         self.bucket = bucket
         self.baseurl = baseurl
         self.prefix = prefix
@@ -11,7 +16,39 @@ class Settings(object):
         self.sign = sign
         self.sign_with = sign_with
         self.identity = identity
+        self.jobs = jobs
+        self.downloads = downloads
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+        self.max_requests = max_requests
+        self.local_dir = local_dir
+        self.manifest_format = manifest_format
+        self.simple_json_prefix = simple_json_prefix
+        self.compress = compress
+        self.cache_control = cache_control
+        self.recent_versions = recent_versions
+        self.page_size = page_size
+        self.processes = processes
 
     def create_repository(self):
-        repo = Repository(self.bucket, self.baseurl, self.prefix, self.profile)
+        # The repository and storage modules pull in boto3 and twine, which are slow to import, so they are
+        # only imported once a command actually needs them
+        from .repository import Repository
+        from .storage import LocalStorage
+
+        if self.cache_dir:
+            j2.configure(os.path.join(self.cache_dir, 'templates'))
+        cache = DiskCache(self.cache_dir, self.cache_size * 1024 * 1024) if self.cache_dir else None
+        storage = LocalStorage(self.local_dir) if self.local_dir else None
+        repo = Repository(self.bucket, self.baseurl, self.prefix, self.profile, jobs=self.jobs, downloads=self.downloads, cache=cache,
+                          max_requests=self.max_requests, storage=storage, manifest_format=self.manifest_format,
+                          simple_json_prefix=self.simple_json_prefix, content_encoding=None if self.compress == 'none' else self.compress,
+                          cache_control=self.cache_control, recent_versions=self.recent_versions, page_size=self.page_size)
         return repo
+
+    def create_bucket_storage(self):
+        """Create storage for the S3 Bucket, even if the repository itself is stored in a local directory"""
+        from boto3.s3.transfer import TransferConfig
+        from .storage import S3Storage
+
+        return S3Storage(self.bucket, self.profile, self.jobs * TransferConfig().max_concurrency + self.max_requests)
@@ -0,0 +1,79 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from timeit import default_timer
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+LATENCY_BUCKETS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+class Timing(object):
+    """Handle for a timed operation, used to record the number of bytes it transferred or produced"""
+    def __init__(self):
+        self.size = 0
+
+
+class Stats(object):
+    """Thread-safe counts, byte totals and latency histograms for named operations"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._operations = {}
+
+    @contextmanager
+    def timer(self, operation):
+        """Time the enclosed block, recording it against the named operation"""
+        timing = Timing()
+        start = default_timer()
+        try:
+            yield timing
+        except Exception:
+            self.record(operation, default_timer() - start, timing.size, failed=True)
+            raise
+        self.record(operation, default_timer() - start, timing.size)
+
+    def record(self, operation, seconds, size=0, failed=False):
+        milliseconds = seconds * 1000
+        bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if milliseconds <= bound), len(LATENCY_BUCKETS))
+        with self._lock:
+            entry = self._operations.get(operation)
+            if entry is None:
+                entry = self._operations[operation] = {
+                    'count': 0, 'failed': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'bytes': 0,
+                    'histogram': [0] * (len(LATENCY_BUCKETS) + 1)}
+            entry['count'] += 1
+            entry['failed'] += 1 if failed else 0
+            entry['seconds'] += seconds
+            entry['max_seconds'] = max(entry['max_seconds'], seconds)
+            entry['bytes'] += size
+            entry['histogram'][bucket] += 1
+
+    def get_stats(self):
+        """Return the statistics for each operation, with histogram buckets keyed by their upper bound in milliseconds"""
+        stats = OrderedDict()
+        with self._lock:
+            for operation in sorted(self._operations):
+                entry = dict(self._operations[operation])
+                labels = [str(bound) for bound in LATENCY_BUCKETS] + ['+Inf']
+                entry['histogram'] = OrderedDict(zip(labels, entry['histogram']))
+                stats[operation] = entry
+        return stats
+
+    def format_summary(self):
+        """Return the statistics as lines of a text table"""
+        line = '{0:<28} {1:>7} {2:>6} {3:>10} {4:>9} {5:>9} {6:>9} {7:>12}'
+        lines = [line.format('operation', 'count', 'failed', 'total (s)', 'mean (ms)', 'p95 (ms)', 'max (ms)', 'bytes')]
+        for operation, entry in self.get_stats().items():
+            lines.append(line.format(
+                operation, entry['count'], entry['failed'], '{0:.3f}'.format(entry['seconds']),
+                '{0:.1f}'.format(entry['seconds'] * 1000 / entry['count']), _percentile(entry['histogram'], entry['count'], 0.95),
+                '{0:.1f}'.format(entry['max_seconds'] * 1000), entry['bytes']))
+        return lines
+
+
+def _percentile(histogram, count, fraction):
+    """Estimate a latency percentile as the upper bound of the histogram bucket that contains it"""
+    total = 0
+    for label, bucket_count in histogram.items():
+        total += bucket_count
+        if total >= count * fraction:
+            return '<=' + label if label != '+Inf' else '>' + str(LATENCY_BUCKETS[-1])
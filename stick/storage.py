@@ -0,0 +1,435 @@
+import errno
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from timeit import default_timer
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+
+from .stats import Timing
+from .util import get_client_config
+
+PAGE_SIZE = 1000
+# Adaptive mode retries throttled requests with backoff, and limits the client's request rate while S3 is throttling it
+RETRIES = {'mode': 'adaptive', 'max_attempts': 10}
+
+logger = logging.getLogger(__name__)
+
+
+def _client_error(code, operation, message=None):
+    """Build the ClientError that S3 would raise, so that callers can handle errors from all storage backends alike"""
+    return ClientError({'Error': {'Code': code, 'Message': message or code}}, operation)
+
+
+def _get_size(body):
+    """Return the size of a bytes or seekable file-like body"""
+    if isinstance(body, bytes):
+        return len(body)
+    position = body.tell()
+    body.seek(0, os.SEEK_END)
+    size = body.tell() - position
+    body.seek(position)
+    return size
+
+
+class Storage(object):
+    """Base class for the object stores that hold repository contents.
+
+    Keys, responses and errors follow S3 conventions: responses are dicts with the same fields as the matching
+    boto3 S3 client responses, and missing objects or failed preconditions raise botocore ClientErrors.
+    """
+    def head(self, key):
+        """Return the metadata for an object"""
+        raise NotImplementedError()
+
+    def get(self, key, if_none_match=None, byte_range=None):
+        """Return the metadata and Body for an object, or an inclusive (start, end) byte range of it"""
+        raise NotImplementedError()
+
+    def put(self, key, body, content_type, content_encoding=None, cache_control=None, if_match=None, if_none_match=None):
+        """Store an object from a bytes or file-like body, optionally recording its content encoding and Cache-Control header.
+
+        If if_match is set, the object is only stored if the existing object has that ETag; if if_none_match is '*',
+        it is only stored if there is no existing object.
+        """
+        raise NotImplementedError()
+
+    def delete(self, key):
+        """Delete an object, if it exists"""
+        raise NotImplementedError()
+
+    def upload_file(self, filename, key, content_type):
+        """Store an object from a local file"""
+        with open(filename, 'rb') as data:
+            return self.put(key, data, content_type)
+
+    def download_file(self, key, filename):
+        """Download an object to a local file"""
+        with open(filename, 'wb') as data:
+            shutil.copyfileobj(self.get(key)['Body'], data)
+
+    def list(self, prefix, delimiter=None):
+        """Yield pages of Contents and CommonPrefixes for the objects under a prefix"""
+        contents = []
+        common_prefixes = []
+        for key in self._list_keys(prefix):
+            if delimiter and delimiter in key[len(prefix):]:
+                common_prefix = key[:key.index(delimiter, len(prefix)) + len(delimiter)]
+                if not common_prefixes or common_prefixes[-1]['Prefix'] != common_prefix:
+                    common_prefixes.append({'Prefix': common_prefix})
+                continue
+
+            # Metadata is only read for keys that are listed individually, as it may be expensive to compute
+            try:
+                metadata = self.head(key)
+            except ClientError as e:
+                if e.response['Error']['Code'] != '404':
+                    raise e
+                continue
+            contents.append({'Key': key, 'ETag': metadata['ETag'], 'Size': metadata['ContentLength'],
+                             'LastModified': metadata['LastModified']})
+
+            if len(contents) + len(common_prefixes) >= PAGE_SIZE:
+                yield {'Contents': contents, 'CommonPrefixes': common_prefixes}
+                contents = []
+                common_prefixes = []
+
+        yield {'Contents': contents, 'CommonPrefixes': common_prefixes}
+
+    def _list_keys(self, prefix):
+        """Yield the key of each object under a prefix, in key order"""
+        raise NotImplementedError()
+
+    def _check_preconditions(self, key, if_match, if_none_match):
+        """Raise the ClientError that S3 would for a conditional put whose precondition does not hold"""
+        if if_match is None and if_none_match is None:
+            return
+        try:
+            etag = self.head(key)['ETag']
+        except ClientError as e:
+            if e.response['Error']['Code'] != '404':
+                raise e
+            etag = None
+
+        if if_match is not None and etag is None:
+            raise _client_error('404', 'PutObject', 'Not Found')
+        if (if_match is not None and if_match != etag) or (if_none_match == '*' and etag is not None):
+            raise _client_error('412', 'PutObject', 'Precondition Failed')
+
+    def _make_response(self, metadata, data, if_none_match, byte_range):
+        if if_none_match is not None and if_none_match == metadata['ETag']:
+            raise _client_error('304', 'GetObject', 'Not Modified')
+        if byte_range is not None:
+            data = data[byte_range[0]:byte_range[1] + 1]
+        return dict(metadata, Body=io.BytesIO(data), ContentLength=len(data))
+
+
+class S3Storage(Storage):
+    """Objects stored in an S3 bucket"""
+    def __init__(self, bucket, profile=None, max_pool_connections=10):
+        self.bucket = bucket
+        self.transfer_config = TransferConfig()
+        self.client = boto3.Session(profile_name=profile).client('s3', config=get_client_config(max_pool_connections=max_pool_connections, retries=RETRIES))
+        # Conditional writes need botocore 1.35.70 or later; older versions reject the parameters before sending the request
+        members = self.client.meta.service_model.operation_model('PutObject').input_shape.members
+        self.conditional_writes = 'IfMatch' in members and 'IfNoneMatch' in members
+        self._warned = False
+
+    def head(self, key):
+        return self.client.head_object(Bucket=self.bucket, Key=key)
+
+    def get(self, key, if_none_match=None, byte_range=None):
+        kwargs = {}
+        if if_none_match is not None:
+            kwargs['IfNoneMatch'] = if_none_match
+        if byte_range is not None:
+            kwargs['Range'] = 'bytes={0}-{1}'.format(*byte_range)
+        return self.client.get_object(Bucket=self.bucket, Key=key, **kwargs)
+
+    def put(self, key, body, content_type, content_encoding=None, cache_control=None, if_match=None, if_none_match=None):
+        kwargs = {}
+        if content_encoding:
+            kwargs['ContentEncoding'] = content_encoding
+        if cache_control:
+            kwargs['CacheControl'] = cache_control
+        if (if_match or if_none_match) and not self.conditional_writes:
+            if not self._warned:
+                logger.warn('This version of botocore does not support conditional writes; concurrent uploads may overwrite each other')
+                self._warned = True
+        else:
+            if if_match:
+                kwargs['IfMatch'] = if_match
+            if if_none_match:
+                kwargs['IfNoneMatch'] = if_none_match
+        return self.client.put_object(Body=body, Bucket=self.bucket, Key=key, ContentType=content_type, **kwargs)
+
+    def delete(self, key):
+        return self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def upload_file(self, filename, key, content_type):
+        if os.path.getsize(filename) < self.transfer_config.multipart_threshold:
+            return super(S3Storage, self).upload_file(filename, key, content_type)
+
+        # Managed transfers do not return the object metadata, so fetch the (multipart) ETag afterwards
+        self.client.upload_file(Filename=filename, Bucket=self.bucket, Key=key,
+                                ExtraArgs={'ContentType': content_type}, Config=self.transfer_config)
+        return self.head(key)
+
+    def download_file(self, key, filename):
+        self.client.download_file(Bucket=self.bucket, Key=key, Filename=filename, Config=self.transfer_config)
+
+    def list(self, prefix, delimiter=None):
+        kwargs = {'Delimiter': delimiter} if delimiter else {}
+        for page in self.client.get_paginator('list_objects').paginate(Bucket=self.bucket, Prefix=prefix, **kwargs):
+            yield page
+
+
+class LocalStorage(Storage):
+    """Objects stored as files within a local directory.
+
+    Keys ending in a slash, such as the HTML indexes, are stored as index.html within the matching directory,
+    so that the directory can be served as-is by a static web server. The content type, encoding and Cache-Control
+    header of each object are recorded in a hidden file alongside it, so that they can be restored when the objects
+    are published to a bucket. Conditional puts are only atomic with respect to other puts by the same process.
+    """
+    INDEX_NAME = 'index.html'
+    # Fields of the object metadata that are recorded alongside each object
+    HEADER_FIELDS = ['CacheControl', 'ContentEncoding', 'ContentType']
+
+    def __init__(self, root):
+        self.root = root
+        self._etags = {}
+        self._lock = threading.Lock()
+
+    def head(self, key):
+        return self._get_metadata(key, 'HeadObject')
+
+    def get(self, key, if_none_match=None, byte_range=None):
+        metadata = self._get_metadata(key, 'GetObject')
+        with open(self._get_path(key), 'rb') as data:
+            if byte_range is None:
+                return self._make_response(metadata, data.read(), if_none_match, None)
+            data.seek(byte_range[0])
+            return self._make_response(metadata, data.read(byte_range[1] - byte_range[0] + 1), if_none_match, None)
+
+    def put(self, key, body, content_type, content_encoding=None, cache_control=None, if_match=None, if_none_match=None):
+        path = self._get_path(key)
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise e
+
+        md5 = hashlib.md5()
+        handle, temp_path = tempfile.mkstemp(dir=directory, prefix='.', suffix='.tmp')
+        with os.fdopen(handle, 'wb') as data:
+            chunks = [body] if isinstance(body, bytes) else iter(lambda: body.read(io.DEFAULT_BUFFER_SIZE * 16), b'')
+            for chunk in chunks:
+                md5.update(chunk)
+                data.write(chunk)
+        headers = {'CacheControl': cache_control, 'ContentEncoding': content_encoding, 'ContentType': content_type}
+        with self._lock:
+            try:
+                self._check_preconditions(key, if_match, if_none_match)
+            except ClientError as e:
+                os.unlink(temp_path)
+                raise e
+            os.rename(temp_path, path)
+            self._write_headers(path, headers)
+
+        stat = os.stat(path)
+        etag = self._etags[(path, stat.st_size, stat.st_mtime)] = '"{0}"'.format(md5.hexdigest())
+        return {'ETag': etag}
+
+    def delete(self, key):
+        path = self._get_path(key)
+        for filename in [path, self._get_headers_path(path)]:
+            try:
+                os.unlink(filename)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise e
+        return {}
+
+    def get_filename(self, key):
+        """Return the name of the file that holds an object"""
+        return self._get_path(key)
+
+    def _get_path(self, key):
+        if key == '' or key.endswith('/'):
+            key += self.INDEX_NAME
+        parts = key.split('/')
+        if '..' in parts or '.' in parts:
+            raise _client_error('400', 'GetObject', 'Invalid key {0}'.format(key))
+        return os.path.join(self.root, *parts)
+
+    def _get_metadata(self, key, operation):
+        path = self._get_path(key)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            raise _client_error('404', operation, 'Not Found')
+
+        # Hashing large files is expensive, so cache ETags until the file is modified
+        signature = (path, stat.st_size, stat.st_mtime)
+        etag = self._etags.get(signature)
+        if etag is None:
+            md5 = hashlib.md5()
+            with open(path, 'rb') as data:
+                for chunk in iter(lambda: data.read(io.DEFAULT_BUFFER_SIZE * 16), b''):
+                    md5.update(chunk)
+            etag = self._etags[signature] = '"{0}"'.format(md5.hexdigest())
+
+        metadata = {'ETag': etag, 'ContentLength': stat.st_size, 'LastModified': datetime.utcfromtimestamp(stat.st_mtime)}
+        metadata.update(self._read_headers(path))
+        return metadata
+
+    def _get_headers_path(self, path):
+        directory, filename = os.path.split(path)
+        return os.path.join(directory, '.{0}.headers'.format(filename))
+
+    def _read_headers(self, path):
+        """Return the recorded headers of the object stored in a file, or none if they were not recorded"""
+        try:
+            with open(self._get_headers_path(path), 'rb') as data:
+                headers = json.loads(data.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            return {}
+        return dict((k, headers.get(k)) for k in self.HEADER_FIELDS)
+
+    def _write_headers(self, path, headers):
+        directory = os.path.dirname(path)
+        handle, temp_path = tempfile.mkstemp(dir=directory, prefix='.', suffix='.tmp')
+        with os.fdopen(handle, 'wb') as data:
+            data.write(json.dumps(headers, sort_keys=True).encode('utf-8'))
+        os.rename(temp_path, self._get_headers_path(path))
+
+    def _list_keys(self, prefix):
+        # Only the directory containing the prefix needs to be searched
+        top = os.path.join(self.root, *prefix.split('/')[:-1])
+        keys = []
+        for directory, dirnames, filenames in os.walk(top):
+            relative = os.path.relpath(directory, self.root).replace(os.sep, '/')
+            relative = '' if relative == '.' else relative + '/'
+            for filename in filenames:
+                if filename.startswith('.'):
+                    continue
+                key = relative if filename == self.INDEX_NAME else relative + filename
+                if key.startswith(prefix):
+                    keys.append(key)
+        return iter(sorted(keys))
+
+
+class MemoryStorage(Storage):
+    """Objects held in memory, for testing and benchmarking without a bucket"""
+    def __init__(self):
+        self.objects = {}
+        self._lock = threading.Lock()
+
+    def head(self, key):
+        try:
+            return dict(self.objects[key][0])
+        except KeyError:
+            raise _client_error('404', 'HeadObject', 'Not Found')
+
+    def get(self, key, if_none_match=None, byte_range=None):
+        try:
+            metadata, data = self.objects[key]
+        except KeyError:
+            raise _client_error('404', 'GetObject', 'Not Found')
+        return self._make_response(metadata, data, if_none_match, byte_range)
+
+    def put(self, key, body, content_type, content_encoding=None, cache_control=None, if_match=None, if_none_match=None):
+        data = body if isinstance(body, bytes) else body.read()
+        metadata = {
+            'ContentLength': len(data),
+            'ContentType': content_type,
+            'CacheControl': cache_control,
+            'ContentEncoding': content_encoding,
+            'ETag': '"{0}"'.format(hashlib.md5(data).hexdigest()),
+            'LastModified': datetime.utcnow(),
+            }
+        with self._lock:
+            self._check_preconditions(key, if_match, if_none_match)
+            self.objects[key] = (metadata, data)
+        return {'ETag': metadata['ETag']}
+
+    def delete(self, key):
+        with self._lock:
+            self.objects.pop(key, None)
+        return {}
+
+    def _list_keys(self, prefix):
+        with self._lock:
+            return iter(sorted(k for k in self.objects if k.startswith(prefix)))
+
+
+class InstrumentedStorage(Storage):
+    """Wrapper that records the number, latency and size of requests made to another storage backend"""
+    def __init__(self, storage, stats):
+        self.storage = storage
+        self.stats = stats
+
+    def head(self, key):
+        with self._timer('HEAD'):
+            return self.storage.head(key)
+
+    def get(self, key, if_none_match=None, byte_range=None):
+        with self._timer('GET') as timing:
+            response = self.storage.get(key, if_none_match, byte_range)
+            timing.size = response.get('ContentLength', 0)
+            return response
+
+    def put(self, key, body, content_type, content_encoding=None, cache_control=None, if_match=None, if_none_match=None):
+        with self._timer('PUT') as timing:
+            timing.size = _get_size(body)
+            return self.storage.put(key, body, content_type, content_encoding, cache_control, if_match, if_none_match)
+
+    def delete(self, key):
+        with self._timer('DELETE'):
+            return self.storage.delete(key)
+
+    def upload_file(self, filename, key, content_type):
+        with self._timer('PUT') as timing:
+            timing.size = os.path.getsize(filename)
+            return self.storage.upload_file(filename, key, content_type)
+
+    def download_file(self, key, filename):
+        with self._timer('GET') as timing:
+            self.storage.download_file(key, filename)
+            timing.size = os.path.getsize(filename)
+
+    def list(self, prefix, delimiter=None):
+        # Pages are requested lazily, so each page is timed from when the previous page was consumed
+        start = default_timer()
+        for page in self.storage.list(prefix, delimiter):
+            self.stats.record('LIST', default_timer() - start)
+            yield page
+            start = default_timer()
+
+    @contextmanager
+    def _timer(self, operation):
+        timing = Timing()
+        start = default_timer()
+        failed = False
+        try:
+            yield timing
+        except ClientError as e:
+            # Conditional requests that find the object unchanged have succeeded
+            failed = e.response['Error']['Code'] not in ['304', 'NotModified']
+            raise e
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.stats.record(operation, default_timer() - start, timing.size, failed)
@@ -1,6 +1,20 @@
-from botocore.client import Config
-from pkg_resources import get_distribution
+try:
+    from importlib.metadata import PackageNotFoundError, version as get_version
+except ImportError:
+    from pkg_resources import DistributionNotFound as PackageNotFoundError, get_distribution
+
+    def get_version(name):
+        return get_distribution(name).version
 
 pkgname = __name__.split('.')[0]
-version = get_distribution(pkgname).version
-client_config = Config(user_agent_extra='{0}/{1}'.format(pkgname, version))
+try:
+    version = get_version(pkgname)
+except PackageNotFoundError:
+    # Running from a source tree that has not been installed, such as when running the benchmarks
+    version = 'unknown'
+
+
+def get_client_config(**kwargs):
+    """Return the botocore client configuration, importing botocore only when a client is actually needed"""
+    from botocore.client import Config
+    return Config(user_agent_extra='{0}/{1}'.format(pkgname, version), **kwargs)
@@ -0,0 +1,75 @@
+import hashlib
+import io
+import os
+import zipfile
+
+import pytest
+from twine.package import PackageFile
+
+from stick.project import Project
+from stick.remote import RemotePackage, parse_metadata
+from stick.repository import Repository
+from stick.storage import MemoryStorage
+
+METADATA = """Metadata-Version: 2.1
+Name: {name}
+Version: {version}
+Summary: Test project
+Requires-Python: >=3.6
+
+Description of {name}
+"""
+
+
+def build_wheel(name, version, extra_files=None):
+    """Return the contents of a small but valid wheel"""
+    dist_info = '{0}-{1}.dist-info/'.format(name, version)
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, 'w', zipfile.ZIP_DEFLATED) as wheel:
+        for filename, contents in (extra_files or {}).items():
+            wheel.writestr(filename, contents)
+        wheel.writestr(dist_info + 'METADATA', METADATA.format(name=name, version=version))
+        wheel.writestr(dist_info + 'WHEEL', 'Wheel-Version: 1.0\nRoot-Is-Purelib: true\nTag: py3-none-any\n')
+        wheel.writestr(dist_info + 'RECORD', '')
+    return data.getvalue()
+
+
+def make_package_info(safe_name, name, version, contents=b''):
+    """Return the manifest entry for a wheel, as built when it is uploaded"""
+    filename = '{0}-{1}-py3-none-any.whl'.format(name, version)
+    package_info = {
+        'filename': filename,
+        'packagetype': 'bdist_wheel',
+        'python_version': 'py3',
+        'digests': {'md5': hashlib.md5(contents).hexdigest(), 'sha256': hashlib.sha256(contents).hexdigest()},
+        }
+    package = RemotePackage(safe_name, package_info, parse_metadata(METADATA.format(name=name, version=version).encode('utf-8')), False)
+    return Project(safe_name, None).make_package_info(package, etag='"{0}"'.format(package.md5_digest), size=len(contents))
+
+
+def write_package(directory, name, version, extra_files=None):
+    """Write a wheel to a directory, returning it as a package ready for upload"""
+    filename = os.path.join(directory, '{0}-{1}-py3-none-any.whl'.format(name, version))
+    with open(filename, 'wb') as data:
+        data.write(build_wheel(name, version, extra_files))
+    return PackageFile.from_filename(filename, '')
+
+
+@pytest.fixture
+def storage():
+    return MemoryStorage()
+
+
+@pytest.fixture
+def repository_factory(storage):
+    """Return a function that creates repositories sharing the same storage, like separate runs against one bucket"""
+    repositories = []
+
+    def factory(**kwargs):
+        repository = Repository('test-bucket', None, 'simple/', None, storage=storage, **kwargs)
+        repositories.append(repository)
+        return repository
+
+    yield factory
+    for repository in repositories:
+        repository._request_executor.shutdown()
@@ -0,0 +1,82 @@
+import pytest
+
+from stick.journal import Journal
+
+from conftest import build_wheel, make_package_info
+
+URL = 'https://test-bucket.s3.amazonaws.com/simple/'
+
+
+def test_resume(tmpdir):
+    path = str(tmpdir.join('journal'))
+    journal = Journal(path, URL)
+    journal.add_package('one', {'filename': 'one-1.0.tar.gz'})
+    journal.complete_project('one', {'etag': '"1"', 'version': '1.0'})
+    journal.complete_project('empty', None)
+    journal.close()
+
+    resumed = Journal(path, URL, resume=True)
+    resumed.close()
+
+    assert resumed.is_complete('one') and resumed.is_complete('empty')
+    assert resumed.get_packages('one') == {'one-1.0.tar.gz': {'filename': 'one-1.0.tar.gz'}}
+    assert resumed.get_catalog() == {'one': {'etag': '"1"', 'version': '1.0'}}
+
+
+def test_resume_truncated(tmpdir):
+    path = str(tmpdir.join('journal'))
+    journal = Journal(path, URL)
+    journal.add_package('one', {'filename': 'one-1.0.tar.gz'})
+    journal.add_package('two', {'filename': 'two-1.0.tar.gz'})
+    journal.close()
+    # Simulate a run that was interrupted while writing the last record
+    with open(path, 'r+b') as data:
+        data.truncate(len(data.read()) - 5)
+
+    resumed = Journal(path, URL, resume=True)
+    resumed.complete_project('one', {'etag': '"1"', 'version': '1.0'})
+    resumed.close()
+
+    assert resumed.get_packages('one') == {'one-1.0.tar.gz': {'filename': 'one-1.0.tar.gz'}}
+    assert resumed.get_packages('two') == {}
+    # Records written after resuming are not appended to the partial line
+    resumed_again = Journal(path, URL, resume=True)
+    resumed_again.close()
+    assert resumed_again.get_catalog() == {'one': {'etag': '"1"', 'version': '1.0'}}
+
+
+def test_resume_other_repository(tmpdir):
+    path = str(tmpdir.join('journal'))
+    Journal(path, URL).close()
+
+    with pytest.raises(ValueError):
+        Journal(path, 'https://other-bucket.s3.amazonaws.com/simple/', resume=True)
+
+
+def test_reindex_resume(tmpdir, storage, repository_factory):
+    for name in ['done', 'pending']:
+        contents = build_wheel(name, '1.0')
+        storage.put('simple/{0}/{0}-1.0-py3-none-any.whl'.format(name), contents, 'application/octet-stream')
+
+    # An earlier run completed one project, and read the package of the other before it was interrupted
+    path = str(tmpdir.join('journal'))
+    journal = Journal(path, URL)
+    journal.complete_project('done', {'etag': '"done"', 'version': '1.0'})
+    key = 'simple/pending/pending-1.0-py3-none-any.whl'
+    package_info = make_package_info('pending', 'pending', '1.0', storage.objects[key][1])
+    package_info['etag'] = storage.head(key)['ETag']
+    journal.add_package('pending', package_info)
+    journal.close()
+
+    repository = repository_factory()
+    journal = Journal(path, repository.get_url(), resume=True)
+    assert repository.reindex([], journal=journal)
+    journal.close()
+
+    # The catalog is looked up, but no packages are downloaded
+    assert repository.stats.get_stats()['GET']['bytes'] == 0
+    assert 'simple/done/manifest.json' not in storage.objects
+    assert 'simple/pending/manifest.json' in storage.objects
+    catalog = repository._get_catalog()
+    assert catalog['done'] == {'etag': '"done"', 'version': '1.0'}
+    assert catalog['pending']['etag'] == storage.head('simple/pending/manifest.json')['ETag']
@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from stick.compression import make_compressor
+from stick.manifest import decode_manifest, encode_manifest
+
+from conftest import make_package_info
+
+
+@pytest.fixture
+def package_infos():
+    package_infos = [make_package_info('pkg', 'pkg', version, version.encode('utf-8')) for version in ['1.0', '1.1', '2.0']]
+    # Files of the same version that differ in more than the per-file fields
+    other = make_package_info('pkg', 'pkg', '2.0', b'other')
+    other.update(filename='pkg-2.0.tar.gz', packagetype='sdist', summary='Different summary')
+    # Entries are compared as they are loaded from a manifest, with lists in place of tuples
+    return json.loads(json.dumps(package_infos + [other]))
+
+
+def _encode(package_infos, manifest_format):
+    return ''.join(encode_manifest(package_infos, manifest_format)).encode('utf-8')
+
+
+@pytest.mark.parametrize('manifest_format', ['legacy', 'compact'])
+def test_round_trip(package_infos, manifest_format):
+    assert decode_manifest(_encode(package_infos, manifest_format)) == package_infos
+
+
+def test_round_trip_gzip(package_infos):
+    compressor = make_compressor('gzip')
+    data = compressor.compress(_encode(package_infos, 'compact')) + compressor.flush()
+
+    assert decode_manifest(data, 'gzip') == package_infos
+
+
+def test_compact_is_smaller(package_infos):
+    assert len(_encode(package_infos, 'compact')) < len(_encode(package_infos, 'legacy'))
+
+
+def test_compact_is_stable(package_infos):
+    assert _encode(package_infos, 'compact') == _encode(list(package_infos), 'compact')
+
+
+def test_unsupported_format():
+    with pytest.raises(ValueError):
+        decode_manifest(b'{"format": 99, "versions": {}, "files": []}')
@@ -0,0 +1,77 @@
+from packaging.version import Version
+
+from stick.project import Project
+
+from conftest import make_package_info
+
+
+def _project(versions):
+    return Project('pkg', None, [make_package_info('pkg', 'pkg', version, version.encode('utf-8')) for version in versions])
+
+
+def test_versions_are_sorted():
+    project = _project(['1.10', '1.2', '1.0', '1.0rc1', '2.0.dev0'])
+
+    assert project._versions == [Version(v) for v in ['1.0rc1', '1.0', '1.2', '1.10', '2.0.dev0']]
+    assert [version for version, _ in project.iter_releases()] == ['1.0rc1', '1.0', '1.2', '1.10', '2.0.dev0']
+    assert project.latest_version == Version('2.0.dev0')
+
+
+def test_latest_version_of_empty_project():
+    project = Project('pkg', None)
+
+    assert project.latest_version is None
+    assert project.get_package_info('pkg-1.0-py3-none-any.whl') is None
+
+
+def test_replace_package():
+    project = _project(['1.0', '1.1'])
+    replacement = make_package_info('pkg', 'pkg', '1.0', b'replaced')
+
+    project.add_package_infos([replacement])
+
+    assert project.get_package_info('pkg-1.0-py3-none-any.whl') is replacement
+    assert project.releases[Version('1.0')] == [replacement]
+    assert len(project.manifest) == 2
+
+
+def test_move_package_to_another_version():
+    project = _project(['1.0', '1.1'])
+    # The same file, with its metadata corrected to another version
+    moved = dict(make_package_info('pkg', 'pkg', '1.0'), version='2.0')
+
+    project.add_package_infos([moved])
+
+    # The release it was moved from is empty, so it is removed
+    assert Version('1.0') not in project.releases
+    assert project._versions == [Version('1.1'), Version('2.0')]
+    assert project.releases[Version('2.0')] == [moved]
+    assert project.latest_version == Version('2.0')
+    assert project.get_package_info('pkg-1.0-py3-none-any.whl')['version'] == '2.0'
+
+
+def test_add_files_to_release():
+    project = _project(['1.0'])
+    sdist = dict(make_package_info('pkg', 'pkg', '1.0'), filename='pkg-1.0.tar.gz', packagetype='sdist')
+    other = dict(make_package_info('pkg', 'pkg', '1.0'), filename='pkg-1.0-py2-none-any.whl')
+
+    project.add_package_infos([sdist, other])
+
+    # Files within a release are ordered by package type, then filename
+    assert [p['filename'] for p in project.releases[Version('1.0')]] == \
+        ['pkg-1.0-py2-none-any.whl', 'pkg-1.0-py3-none-any.whl', 'pkg-1.0.tar.gz']
+    assert [p['filename'] for p in project.manifest] == ['pkg-1.0-py3-none-any.whl', 'pkg-1.0.tar.gz', 'pkg-1.0-py2-none-any.whl']
+
+
+def test_history_pages():
+    project = _project(['1.0', '1.1', '1.2', '1.3', '1.4'])
+
+    assert project.get_page_count(2) == 3
+    assert project.get_page_count(5) == 1
+    assert Project('pkg', None).get_page_count(2) == 0
+    assert project.get_page_versions(2, 2) == [Version('1.4')]
+    assert [project.get_page_number(2, v) for v in ['1.0', '1.1', '1.2', '1.4']] == [0, 0, 1, 2]
+    # Versions that are not in the project are numbered by the page they would be added to
+    assert project.get_page_number(2, '0.1') == 0
+    assert project.get_page_number(2, '1.2.1') == 1
+    assert project.get_page_number(2, '2.0') == 2
@@ -0,0 +1,86 @@
+import pytest
+
+from stick.repository import Repository
+from stick.storage import LocalStorage, MemoryStorage
+
+from conftest import build_wheel, make_package_info
+
+
+class RecordingStorage(MemoryStorage):
+    """In-memory storage that records the order in which objects are stored"""
+    def __init__(self):
+        super(RecordingStorage, self).__init__()
+        self.puts = []
+
+    def put(self, key, *args, **kwargs):
+        self.puts.append(key)
+        return super(RecordingStorage, self).put(key, *args, **kwargs)
+
+
+@pytest.fixture
+def local_factory(tmpdir):
+    repositories = []
+
+    def factory(**kwargs):
+        repository = Repository('test-bucket', None, 'simple/', None, storage=LocalStorage(str(tmpdir.join('local'))),
+                                simple_json_prefix='simple-json/', **kwargs)
+        repositories.append(repository)
+        return repository
+
+    yield factory
+    for repository in repositories:
+        repository._request_executor.shutdown()
+
+
+def _build(repository):
+    contents = build_wheel('pkg', '1.0')
+    repository.storage.put('simple/pkg/pkg-1.0-py3-none-any.whl', contents, 'application/octet-stream')
+    repository._publish_packages('pkg', [make_package_info('pkg', 'pkg', '1.0', contents)])
+    repository.update_index()
+
+
+def test_local_storage_records_headers(tmpdir):
+    storage = LocalStorage(str(tmpdir))
+    storage.put('simple/pkg/', b'page', 'text/html', 'gzip', 'max-age=300')
+
+    metadata = storage.get('simple/pkg/')
+    assert (metadata['ContentType'], metadata['ContentEncoding'], metadata['CacheControl']) == ('text/html', 'gzip', 'max-age=300')
+    assert [item['Key'] for page in storage.list('simple/') for item in page['Contents']] == ['simple/pkg/']
+
+    storage.delete('simple/pkg/')
+    assert tmpdir.join('simple', 'pkg').listdir() == []
+
+
+def test_publish(local_factory):
+    repository = local_factory(content_encoding='gzip', cache_control='max-age=300')
+    _build(repository)
+    destination = RecordingStorage()
+
+    repository.publish_to(destination)
+
+    assert destination.puts[0] == 'simple/pkg/pkg-1.0-py3-none-any.whl'
+    assert destination.puts[-1] == 'simple/projects.json'
+    assert set(destination.puts) == set(key for page in repository.storage.list('') for key in [i['Key'] for i in page['Contents']])
+    metadata = destination.head('simple/pkg/')
+    assert (metadata['ContentType'], metadata['ContentEncoding'], metadata['CacheControl']) == \
+        ('text/html; charset=utf-8', 'gzip', 'max-age=300')
+    assert destination.head('simple-json/pkg/')['ContentType'] == 'application/vnd.pypi.simple.v1+json'
+    assert destination.head('simple/pkg/pkg-1.0-py3-none-any.whl')['CacheControl'] is None
+
+    # Only the repository indexes and catalog are copied again
+    destination.puts = []
+    local_factory(content_encoding='gzip', cache_control='max-age=300').publish_to(destination)
+    assert sorted(destination.puts) == ['simple-json/', 'simple/', 'simple/projects.json']
+
+
+def test_publish_changed_headers(local_factory):
+    _build(local_factory())
+    destination = RecordingStorage()
+    local_factory().publish_to(destination)
+
+    local_factory(cache_control='max-age=300').reindex([])
+    destination.puts = []
+    local_factory(cache_control='max-age=300').publish_to(destination)
+
+    assert 'simple/pkg/pkg-1.0-py3-none-any.whl' not in destination.puts
+    assert [key for key in destination.objects if key.endswith('/') and destination.head(key)['CacheControl'] != 'max-age=300'] == []
@@ -0,0 +1,56 @@
+import struct
+import zipfile
+
+import pytest
+
+from stick import remote
+from stick.remote import read_wheel_metadata
+
+from conftest import build_wheel
+
+
+def _read(data, requests=None):
+    def read_range(start, end):
+        if requests is not None:
+            requests.append((start, end))
+        return data[start:end + 1]
+    return read_range
+
+
+def test_read_wheel_metadata():
+    data = build_wheel('pkg', '1.0', {'pkg/__init__.py': 'x = 1\n' * 1000})
+    requests = []
+
+    metadata = read_wheel_metadata(_read(data, requests), len(data))
+
+    assert b'Name: pkg\nVersion: 1.0\n' in metadata
+    # The end of central directory, the central directory, and the member itself
+    assert len(requests) <= 3
+
+
+def test_read_wheel_metadata_zip64(monkeypatch):
+    # Lowering the limit makes zipfile write the zip64 structures that it otherwise only uses for archives over 4GiB
+    monkeypatch.setattr(zipfile, 'ZIP64_LIMIT', 8)
+    data = build_wheel('pkg', '1.0', {'pkg/__init__.py': 'x = 1\n' * 1000})
+    monkeypatch.undo()
+
+    # zipfile only marks the end of central directory record as zip64 when the directory itself is beyond the limit
+    eocd = data.rfind(remote.EOCD_SIGNATURE)
+    record = list(struct.unpack_from(remote.EOCD_FORMAT, data, eocd))
+    record[5] = record[6] = remote.ZIP64_LIMIT
+    data = data[:eocd] + struct.pack(remote.EOCD_FORMAT, *record) + data[eocd + struct.calcsize(remote.EOCD_FORMAT):]
+    assert remote.EOCD64_LOCATOR_SIGNATURE in data
+    entry = data.rfind(remote.CENTRAL_SIGNATURE, 0, data.rfind(b'pkg-1.0.dist-info/METADATA'))
+    assert struct.unpack_from(remote.CENTRAL_FORMAT, data, entry)[16] == remote.ZIP64_LIMIT
+
+    assert b'Name: pkg\nVersion: 1.0\n' in read_wheel_metadata(_read(data), len(data))
+
+
+def test_read_wheel_metadata_invalid():
+    data = build_wheel('pkg', '1.0')
+
+    with pytest.raises(ValueError):
+        read_wheel_metadata(_read(b'not a zip file'), len(b'not a zip file'))
+    with pytest.raises(ValueError):
+        # Truncated archives point outside of the file
+        read_wheel_metadata(_read(data[100:]), len(data) - 100)
@@ -0,0 +1,260 @@
+import json
+import threading
+
+import pytest
+from packaging.version import InvalidVersion
+from twine.package import PackageFile
+
+from stick.manifest import decode_manifest
+
+from conftest import build_wheel, make_package_info, write_package
+
+
+def _manifest_filenames(storage, safe_name):
+    return sorted(p['filename'] for p in decode_manifest(storage.objects['simple/{0}/manifest.json'.format(safe_name)][1]))
+
+
+def test_publish_conflicting_writers(storage, repository_factory):
+    first = repository_factory()
+    second = repository_factory()
+    # Both writers read the project before either has published it
+    first._get_project('pkg')
+    second._get_project('pkg')
+
+    first._publish_packages('pkg', [make_package_info('pkg', 'pkg', '1.0', b'1.0')])
+    second._publish_packages('pkg', [make_package_info('pkg', 'pkg', '2.0', b'2.0')])
+
+    assert _manifest_filenames(storage, 'pkg') == ['pkg-1.0-py3-none-any.whl', 'pkg-2.0-py3-none-any.whl']
+    index = storage.objects['simple/pkg/'][1].decode('utf-8')
+    assert 'pkg-1.0-py3-none-any.whl' in index and 'pkg-2.0-py3-none-any.whl' in index
+
+
+def test_publish_concurrent_writers(storage, repository_factory):
+    versions = ['1.{0}'.format(i) for i in range(8)]
+    repositories = [repository_factory() for _ in versions]
+    barrier = threading.Barrier(len(versions))
+    errors = []
+
+    def publish(repository, version):
+        repository._get_project('pkg')
+        barrier.wait()
+        try:
+            repository._publish_packages('pkg', [make_package_info('pkg', 'pkg', version, version.encode('utf-8'))])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=publish, args=args) for args in zip(repositories, versions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert _manifest_filenames(storage, 'pkg') == ['pkg-{0}-py3-none-any.whl'.format(v) for v in versions]
+    # Whichever writer finished last, the indexes are generated from the final manifest
+    metadata = json.loads(storage.objects['simple/pkg/json'][1].decode('utf-8'))
+    assert sorted(metadata['releases']) == versions
+
+
+def test_update_index_conflicting_writers(storage, repository_factory, monkeypatch):
+    first = repository_factory()
+    second = repository_factory()
+    first._publish_packages('one', [make_package_info('one', 'one', '1.0')])
+    first.update_index()
+    first._publish_packages('one', [make_package_info('one', 'one', '1.1')])
+    second._publish_packages('two', [make_package_info('two', 'two', '1.0')])
+
+    # The second writer updates the catalog after the first has read it, but before the first writes it
+    get_catalog = first._get_catalog
+
+    def interleaved_get_catalog():
+        catalog = get_catalog()
+        monkeypatch.setattr(first, '_get_catalog', get_catalog)
+        second.update_index()
+        return catalog
+
+    monkeypatch.setattr(first, '_get_catalog', interleaved_get_catalog)
+    first.update_index()
+
+    catalog = json.loads(storage.objects['simple/projects.json'][1].decode('utf-8'))
+    assert catalog['projects']['one']['version'] == '1.1'
+    assert catalog['projects']['two']['version'] == '1.0'
+
+
+def test_simple_json_normalized_names(storage, repository_factory):
+    repository = repository_factory(simple_json_prefix='simple-json/')
+    repository._publish_packages('Foo-Bar', [make_package_info('Foo-Bar', 'Foo_Bar', '1.0')])
+    repository.update_index()
+
+    assert 'simple-json/Foo-Bar/' not in storage.objects
+    page = json.loads(storage.objects['simple-json/foo-bar/'][1].decode('utf-8'))
+    assert page['name'] == 'foo-bar'
+    assert [f['filename'] for f in page['files']] == ['Foo_Bar-1.0-py3-none-any.whl']
+    index = json.loads(storage.objects['simple-json/'][1].decode('utf-8'))
+    assert index['projects'] == [{'name': 'foo-bar'}]
+
+
+def test_reindex_removes_unnormalized_simple_json(storage, repository_factory):
+    storage.put('simple/Foo-Bar/Foo_Bar-1.0-py3-none-any.whl', build_wheel('Foo_Bar', '1.0'), 'application/octet-stream')
+    storage.put('simple-json/Foo-Bar/', b'{}', 'application/vnd.pypi.simple.v1+json')
+
+    assert repository_factory(simple_json_prefix='simple-json/').reindex([])
+
+    assert 'simple-json/Foo-Bar/' not in storage.objects
+    assert 'simple-json/foo-bar/' in storage.objects
+
+
+def _page_keys(storage):
+    return [key for key in storage.objects if not key.endswith(('.whl', 'manifest.json', 'projects.json'))]
+
+
+def test_reindex_rewrites_pages_with_changed_headers(storage, repository_factory):
+    for version in ['1.0', '1.1']:
+        storage.put('simple/pkg/pkg-{0}-py3-none-any.whl'.format(version), build_wheel('pkg', version), 'application/octet-stream')
+    repository_factory().reindex([])
+
+    unchanged = repository_factory()
+    unchanged.reindex([])
+    assert unchanged.objects_written == 0
+
+    changed = repository_factory(cache_control='max-age=300')
+    changed.reindex([])
+    assert [key for key in _page_keys(storage) if storage.objects[key][0]['CacheControl'] != 'max-age=300'] == []
+
+    unchanged = repository_factory(cache_control='max-age=300')
+    unchanged.reindex([])
+    assert unchanged.objects_written == 0
+
+
+def test_upload_leaves_other_pages_with_changed_headers(storage, repository_factory):
+    storage.put('simple/pkg/pkg-1.0-py3-none-any.whl', build_wheel('pkg', '1.0'), 'application/octet-stream')
+    repository_factory().reindex([])
+
+    # Uploading a new version does not rewrite the pages of other versions, so a reindex must still rewrite them
+    repository = repository_factory(cache_control='max-age=300')
+    repository._publish_packages('pkg', [make_package_info('pkg', 'pkg', '1.1')])
+    repository.update_index()
+    assert storage.objects['simple/pkg/1.0/'][0]['CacheControl'] is None
+
+    repository_factory(cache_control='max-age=300').reindex(['pkg'])
+    assert storage.objects['simple/pkg/1.0/'][0]['CacheControl'] == 'max-age=300'
+    assert storage.objects['simple/'][0]['CacheControl'] == 'max-age=300'
+
+
+def test_upload_invalid_package(tmpdir, storage, repository_factory):
+    repository = repository_factory()
+    packages = [write_package(str(tmpdir), 'bad', '1.0-foo'), write_package(str(tmpdir), 'good', '1.0')]
+
+    with pytest.raises(InvalidVersion):
+        repository.upload_packages(packages)
+    repository.update_index()
+
+    # The invalid package is never uploaded, and the valid one is still published
+    assert [key for key in storage.objects if key.startswith('simple/bad/')] == []
+    assert _manifest_filenames(storage, 'good') == ['good-1.0-py3-none-any.whl']
+    assert 'simple/good/' in storage.objects
+    catalog = json.loads(storage.objects['simple/projects.json'][1].decode('utf-8'))
+    assert list(catalog['projects']) == ['good']
+
+
+def test_unchanged_simple_json_pages_are_skipped(storage, repository_factory):
+    storage.put('simple/Foo-Bar/Foo_Bar-1.0-py3-none-any.whl', build_wheel('Foo_Bar', '1.0'), 'application/octet-stream')
+    repository_factory(simple_json_prefix='simple-json/').reindex([])
+
+    repository = repository_factory(simple_json_prefix='simple-json/')
+    repository.reindex([], metadata_only=True)
+    assert repository.objects_written == 0
+
+    # The ETag of the repository page is recorded in the catalog, as it is not listed when uploading
+    repository = repository_factory(simple_json_prefix='simple-json/')
+    repository.update_index()
+    assert repository.objects_written == 0
+
+    repository = repository_factory(simple_json_prefix='simple-json/', cache_control='max-age=300')
+    repository.reindex([], metadata_only=True)
+    assert storage.objects['simple-json/'][0]['CacheControl'] == 'max-age=300'
+    assert storage.objects['simple-json/foo-bar/'][0]['CacheControl'] == 'max-age=300'
+
+
+def test_check_project(storage, repository_factory, caplog):
+    package_infos = [make_package_info('pkg', 'pkg', version, version.encode('utf-8')) for version in ['1.0', '1.1', '1.2', '1.3']]
+    package_infos[3]['has_sig'] = True
+    for package_info in package_infos:
+        storage.put('simple/pkg/' + package_info['filename'], package_info['version'].encode('utf-8'), 'application/octet-stream')
+    storage.put('simple/pkg/pkg-1.1-py3-none-any.whl.asc', b'signature', 'application/pgp-signature')
+    storage.put('simple/pkg/pkg-0.9.tar.gz', b'0.9', 'application/octet-stream')
+    repository_factory()._publish_packages('pkg', package_infos)
+    storage.delete('simple/pkg/pkg-1.1-py3-none-any.whl')
+    storage.put('simple/pkg/pkg-1.2-py3-none-any.whl', b'changed', 'application/octet-stream')
+
+    repository = repository_factory()
+    repository.check(['pkg'])
+
+    assert sorted(r.getMessage() for r in caplog.records if r.levelname == 'WARNING') == [
+        'ETag changed for pkg/pkg-1.2-py3-none-any.whl - "{0}" -> {1}'.format(
+            package_infos[2]['digests']['md5'], storage.head('simple/pkg/pkg-1.2-py3-none-any.whl')['ETag']),
+        'File missing for pkg/pkg-1.1-py3-none-any.whl',
+        'File not in manifest for pkg/pkg-0.9.tar.gz',
+        'Signature missing for pkg/pkg-1.3-py3-none-any.whl',
+        ]
+    # The files are compared against a single listing of the project, rather than checked one at a time
+    stats = repository.stats.get_stats()
+    assert 'HEAD' not in stats
+    assert stats['LIST']['count'] == 1
+
+
+def _history_pages(storage):
+    return sorted(key for key in storage.objects if '/page/' in key)
+
+
+def test_history_pages_from_first_changed_page(storage, repository_factory, monkeypatch):
+    versions = ['1.0', '1.1', '1.2', '1.3', '1.4']
+    repository_factory(recent_versions=2, page_size=2)._publish_packages('pkg', [make_package_info('pkg', 'pkg', v) for v in versions])
+    assert _history_pages(storage) == ['simple/pkg/page/{0}/{1}'.format(page, key) for page in range(3) for key in ['', 'json']]
+
+    published = []
+    for version, pages in [('2.0', [2]), ('1.2.1', [1, 2, 3]), ('0.1', [0, 1, 2, 3])]:
+        repository = repository_factory(recent_versions=2, page_size=2)
+        put_history_page = repository._put_history_page
+        monkeypatch.setattr(repository, '_put_history_page', lambda *args: published.append(args[2]) or put_history_page(*args))
+        repository._publish_packages('pkg', [make_package_info('pkg', 'pkg', version)])
+        assert sorted(published) == pages
+        del published[:]
+
+    page = json.loads(storage.objects['simple/pkg/page/1/json'][1].decode('utf-8'))
+    assert list(page['releases']) == ['1.1', '1.2']
+
+
+def test_delete_history_pages(storage, repository_factory):
+    for version in ['1.0', '1.1', '1.2', '1.3', '1.4']:
+        storage.put('simple/pkg/pkg-{0}-py3-none-any.whl'.format(version), build_wheel('pkg', version), 'application/octet-stream')
+    repository_factory(recent_versions=2, page_size=2).reindex(['pkg'])
+    storage.put('simple/pkg/page/other/', b'', 'text/html')
+
+    # Pages beyond the end of the history are deleted when the page size grows
+    repository_factory(recent_versions=2, page_size=3).reindex(['pkg'])
+    assert _history_pages(storage) == ['simple/pkg/page/0/', 'simple/pkg/page/0/json', 'simple/pkg/page/1/', 'simple/pkg/page/1/json',
+                                       'simple/pkg/page/other/']
+
+    # All pages are deleted once the index lists every version again
+    repository_factory().reindex(['pkg'])
+    assert _history_pages(storage) == ['simple/pkg/page/other/']
+
+
+def test_get_changed_packages(tmpdir, repository_factory, caplog):
+    first, second = tmpdir.mkdir('first'), tmpdir.mkdir('second')
+    unchanged = write_package(str(first), 'pkg', '1.0')
+    repository_factory().upload_packages([unchanged, write_package(str(first), 'pkg', '1.1')])
+
+    changed = write_package(str(first), 'pkg', '1.1', {'pkg/__init__.py': 'changed'})
+    new = write_package(str(first), 'other', '1.0')
+    # Another directory may hold a different file of the same name, as well as an identical copy
+    conflicting = write_package(str(second), 'other', '1.0', {'other/__init__.py': 'conflicting'})
+    first.join(changed.basefilename).copy(second)
+    copy = PackageFile.from_filename(str(second.join(changed.basefilename)), '')
+
+    packages = repository_factory().get_changed_packages([unchanged, changed, new, conflicting, copy])
+
+    assert packages == [changed, new]
+    assert [r.getMessage() for r in caplog.records if r.levelname == 'WARNING'] == \
+        ['Skipping {0} because it differs from {1}, which has the same name'.format(conflicting.filename, new.filename)]
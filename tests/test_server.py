@@ -0,0 +1,102 @@
+import os
+import threading
+from contextlib import closing
+
+import pytest
+
+from stick.cache import DiskCache
+from stick.server import CachingProxy, ProxyServer
+
+try:
+    from urllib.request import urlopen
+except ImportError:
+    from urllib2 import urlopen
+
+CACHE_SIZE = 1024 * 1024
+
+
+@pytest.fixture
+def proxy(tmpdir, storage, repository_factory):
+    repository = repository_factory(cache=DiskCache(str(tmpdir.join('cache')), CACHE_SIZE))
+    for name in ['one', 'two', 'three', 'four', 'five']:
+        storage.put('simple/{0}/'.format(name), name.encode('utf-8') * 1000, 'text/html')
+    storage.put('simple/big/big-1.0-py3-none-any.whl', os.urandom(3 * CACHE_SIZE), 'application/octet-stream')
+    return CachingProxy(repository)
+
+
+def _read(proxy, key):
+    metadata, body, size = proxy.open(key)
+    with closing(body):
+        data = body.read()
+    assert len(data) == size
+    return data
+
+
+def _cache_entries(proxy):
+    return [name for name in os.listdir(proxy.repository.cache.directory) if not name.endswith('.tmp')]
+
+
+def test_cached_objects_are_not_downloaded_again(storage, proxy):
+    assert _read(proxy, 'simple/one/') == b'one' * 1000
+    assert _read(proxy, 'simple/one/') == b'one' * 1000
+
+    assert proxy.repository.stats.get_stats()['GET']['count'] == 1
+
+
+def test_cached_objects_are_revalidated(storage, proxy):
+    proxy.revalidate_after = 0
+    _read(proxy, 'simple/one/')
+    storage.put('simple/one/', b'changed', 'text/html')
+
+    assert _read(proxy, 'simple/one/') == b'changed'
+
+
+def test_objects_larger_than_cache_are_streamed(storage, proxy):
+    for name in ['one', 'two', 'three', 'four', 'five']:
+        _read(proxy, 'simple/{0}/'.format(name))
+
+    key = 'simple/big/big-1.0-py3-none-any.whl'
+    assert _read(proxy, key) == storage.objects[key][1]
+    assert _read(proxy, key) == storage.objects[key][1]
+
+    # Cached pages are not evicted for an object that is not kept, and the object is downloaded once per request
+    assert len(_cache_entries(proxy)) == 5
+    stats = proxy.repository.stats.get_stats()['GET']
+    assert stats['count'] == 7
+    assert stats['bytes'] == 2 * len(storage.objects[key][1]) + sum(len(name) * 1000 for name in ['one', 'two', 'three', 'four', 'five'])
+
+
+def test_put_larger_than_cache(tmpdir):
+    cache = DiskCache(str(tmpdir), 1000)
+    assert cache.put('small', {'ETag': '"1"'}, b'x' * 500)
+
+    assert not cache.put('large', {'ETag': '"2"'}, b'x' * 1001)
+    assert cache.get('large') == (None, None)
+    assert cache.get('small')[1] == b'x' * 500
+
+
+def test_evict_keeps_new_entry(tmpdir):
+    cache = DiskCache(str(tmpdir), 1000)
+    cache.put('old', {'ETag': '"1"'}, b'x' * 500)
+    # With its metadata, the entry is larger than the cache, but it is still kept
+    assert cache.put('new', {'ETag': '"2"'}, b'x' * 1000)
+
+    assert cache.get('old') == (None, None)
+    assert cache.get('new')[1] == b'x' * 1000
+
+
+def test_server(storage, proxy):
+    server = ProxyServer(('127.0.0.1', 0), proxy)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        url = 'http://127.0.0.1:{0}/'.format(server.server_address[1])
+        with closing(urlopen(url + 'simple/big/big-1.0-py3-none-any.whl')) as response:
+            assert response.read() == storage.objects['simple/big/big-1.0-py3-none-any.whl'][1]
+        with closing(urlopen(url + 'simple/one/')) as response:
+            assert response.headers['Content-Type'] == 'text/html'
+            assert response.read() == b'one' * 1000
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()